@@ -0,0 +1,198 @@
+"""
+Benchmarks the consul exec module's ACL reconciliation against the fake API
+
+For each size, the harness declares that many policies and that many tokens
+(each linked to one policy) and runs three passes through
+``reconcile_policies``/``reconcile_tokens``, each as a fresh run:
+
+* ``create``: against an empty cluster
+* ``noop``: everything already matches
+* ``test``: a dry run with every policy's rules changed
+
+and reports the number of HTTP requests, wall time and peak Python memory of
+each pass. Memory is measured on a separate run since tracing it skews the
+timings. Run it with ``python -m benchmarks.consul_acl`` or ``inv bench.acl``.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import importlib.util
+import time
+import tracemalloc
+from pathlib import Path
+
+from .fake_consul import FakeConsul
+
+
+REPO_ROOT = Path(__file__).parent.parent
+MODULE_PATH = REPO_ROOT / "root" / "states" / "_modules" / "consul.py"
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+
+def load_consul_module(config):
+    """
+    Loads the exec module outside of salt, filling in the loader dunders it
+    uses.
+    """
+
+    spec = importlib.util.spec_from_file_location("consul", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    module.__salt__ = {"config.get": lambda key, default=None: config.get(key, default)}
+    module.__context__ = {}
+    spec.loader.exec_module(module)
+    return module
+
+
+def desired_acls(size, rules="read"):
+    policies = [
+        {
+            "name": f"bench-policy-{i}",
+            "description": f"Benchmark policy {i}",
+            "rules": f'key_prefix "bench/{i}/" {{ policy = "{rules}" }}',
+        }
+        for i in range(size)
+    ]
+    tokens = [
+        {
+            "name": f"bench-token-{i}",
+            "description": f"Benchmark token {i}",
+            "secret": f"00000000-0000-4000-8000-{i:012d}",
+            "policies": [f"bench-policy-{i}"],
+        }
+        for i in range(size)
+    ]
+    return policies, tokens
+
+
+def run_pass(consul, module, policies, tokens, test=False, trace_memory=False):
+    """
+    Reconciles the desired ACLs as a fresh state run would, and measures it.
+    Tracing memory slows Python down considerably, so it is only done when
+    asked for and the timings of such a pass should be ignored.
+    """
+
+    module.__context__.clear()
+    consul.store.reset_counts()
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    results = module.reconcile_policies(policies, consul.url, None, test=test)
+    results.update(module.reconcile_tokens(tokens, consul.url, None, test=test))
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    failed = [ret for ret in results.values() if ret["result"] is False]
+    if failed:
+        raise RuntimeError(f"{len(failed)} failures, e.g. {failed[0]['comment']}")
+
+    return {
+        "requests": consul.store.requests,
+        "seconds": elapsed,
+        "peak_mib": None if peak is None else peak / 2 ** 20,
+        "by_endpoint": dict(consul.store.requests_by_endpoint),
+    }
+
+
+def run_passes(size, latency, config, trace_memory=False):
+    """
+    Runs the create, noop and test passes against a fresh fake cluster.
+
+    Returns:
+        A list of (pass name, stats) tuples
+    """
+
+    policies, tokens = desired_acls(size)
+    changed_policies, _ = desired_acls(size, rules="write")
+    passes = [
+        ("create", policies, tokens, False),
+        ("noop", policies, tokens, False),
+        ("test", changed_policies, tokens, True),
+    ]
+
+    with FakeConsul(latency=latency) as consul:
+        module = load_consul_module(config)
+        return [
+            (name, run_pass(consul, module, *args, trace_memory=trace_memory))
+            for name, *args in passes
+        ]
+
+
+def run(sizes=DEFAULT_SIZES, latency=0.0, config=None, memory=True, verbose=False):
+    """
+    Prints one line per size and pass. Timings and request counts come from an
+    untraced run; with ``memory`` the passes are repeated on a fresh fake
+    cluster with tracemalloc on to find the peak.
+    """
+
+    config = dict(config or {})
+
+    print(
+        f"{'size':>6} {'pass':<7} {'requests':>9} {'seconds':>9} "
+        f"{'req/s':>9} {'peak MiB':>9}"
+    )
+    for size in sizes:
+        timed = run_passes(size, latency, config)
+        traced = run_passes(size, latency, config, trace_memory=True) if memory else []
+        peaks = {name: stats["peak_mib"] for name, stats in traced}
+
+        for name, stats in timed:
+            rate = stats["requests"] / stats["seconds"] if stats["seconds"] else 0
+            peak = f"{peaks[name]:>9.2f}" if name in peaks else f"{'-':>9}"
+            print(
+                f"{size:>6} {name:<7} {stats['requests']:>9} "
+                f"{stats['seconds']:>9.3f} {rate:>9.0f} {peak}"
+            )
+            if verbose:
+                for endpoint, count in sorted(stats["by_endpoint"].items()):
+                    print(f"{'':>16} {count:>9}  {endpoint}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma separated numbers of policies/tokens to reconcile",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--config",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="consul module config, e.g. consul:backend=asyncio",
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="skip the traced runs that measure peak memory",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="break requests down per endpoint"
+    )
+    args = parser.parse_args()
+
+    config = {}
+    for item in args.config:
+        key, _, value = item.partition("=")
+        config[key] = int(value) if value.isdigit() else value
+
+    run(
+        sizes=[int(size) for size in args.sizes.split(",")],
+        latency=args.latency,
+        config=config,
+        memory=args.memory,
+        verbose=args.verbose,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+In-process stand-in for the Consul ACL HTTP API
+
+Implements just enough of ``acl/policies``, ``acl/policy/*``, ``acl/tokens``
+and ``acl/token/*`` for the consul exec module: per-table ``X-Consul-Index``
+headers, blocking queries (``?index=`` and ``?wait=``), Consul's 403 for
+unknown objects, and an optional fixed latency added to every request.
+
+Run it standalone with ``python -m benchmarks.fake_consul --port 8500``.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+DETAIL_PATH = re.compile(r"^/v1/acl/(policy|token)(?:/([^/]+))?$")
+DURATION = re.compile(r"^(\d+(?:\.\d+)?)(ms|s|m|h)$")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value, default=300.0):
+    match = DURATION.match(value or "")
+    if not match:
+        return default
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+class AclStore:
+    """
+    The ACL tables and their raft-style indexes. Every write bumps the global
+    index and stamps it on the table it touched, like Consul does.
+    """
+
+    def __init__(self):
+        self.policies = {}
+        self.tokens = {}
+        self.index = 1
+        self.table_index = {"policies": 1, "tokens": 1}
+        self.changed = threading.Condition()
+
+        self.requests = 0
+        self.requests_by_endpoint = {}
+
+    def count(self, method, endpoint):
+        with self.changed:
+            self.requests += 1
+            key = f"{method} {endpoint}"
+            self.requests_by_endpoint[key] = self.requests_by_endpoint.get(key, 0) + 1
+
+    def reset_counts(self):
+        with self.changed:
+            self.requests = 0
+            self.requests_by_endpoint = {}
+
+    def bump(self, table):
+        self.index += 1
+        self.table_index[table] = self.index
+        self.changed.notify_all()
+
+    def wait_for(self, table, index, timeout):
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while self.table_index[table] <= index:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            return self.table_index[table]
+
+    def policy_links(self, links):
+        by_name = {policy["Name"]: policy for policy in self.policies.values()}
+        resolved = []
+        for link in links or []:
+            policy = self.policies.get(link.get("ID")) or by_name.get(link.get("Name"))
+            if policy is None:
+                raise KeyError(f"cannot find policy {link}")
+            resolved.append({"ID": policy["ID"], "Name": policy["Name"]})
+        return resolved
+
+    def put_policy(self, policy_id, body):
+        with self.changed:
+            if policy_id is None:
+                names = {policy["Name"] for policy in self.policies.values()}
+                if body.get("Name") in names:
+                    raise ValueError("Invalid Policy: A Policy with Name exists")
+                policy_id = str(uuid.uuid4())
+                create_index = self.index + 1
+            elif policy_id in self.policies:
+                create_index = self.policies[policy_id]["CreateIndex"]
+            else:
+                raise LookupError("ACL not found")
+
+            self.bump("policies")
+            policy = {
+                "ID": policy_id,
+                "Name": body.get("Name"),
+                "Description": body.get("Description", ""),
+                "Rules": body.get("Rules", ""),
+                "Datacenters": body.get("Datacenters"),
+                "Hash": str(uuid.uuid4()),
+                "CreateIndex": create_index,
+                "ModifyIndex": self.index,
+            }
+            self.policies[policy_id] = policy
+            return policy
+
+    def put_token(self, accessor, body):
+        with self.changed:
+            if accessor is None:
+                accessor = body.get("AccessorID") or str(uuid.uuid4())
+                if accessor in self.tokens:
+                    raise ValueError("Invalid Token: AccessorID is already in use")
+                secret = body.get("SecretID") or str(uuid.uuid4())
+                create_index = self.index + 1
+            elif accessor in self.tokens:
+                existing = self.tokens[accessor]
+                secret = existing["SecretID"]
+                create_index = existing["CreateIndex"]
+            else:
+                raise LookupError("ACL not found")
+
+            policies = self.policy_links(body.get("Policies"))
+            self.bump("tokens")
+            token = {
+                "AccessorID": accessor,
+                "SecretID": secret,
+                "Description": body.get("Description", ""),
+                "Policies": policies,
+                "Roles": body.get("Roles") or [],
+                "Local": body.get("Local", False),
+                "Hash": str(uuid.uuid4()),
+                "CreateIndex": create_index,
+                "ModifyIndex": self.index,
+            }
+            self.tokens[accessor] = token
+            return token
+
+    def delete(self, table, item_id):
+        with self.changed:
+            store = getattr(self, table)
+            if store.pop(item_id, None) is not None:
+                self.bump(table)
+
+
+def make_handler(store, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this, Nagle's
+        # algorithm and delayed ACKs add ~40ms to every keep-alive request.
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body, table=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if table is not None:
+                self.send_header("X-Consul-Index", str(store.table_index[table]))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def dispatch(self, method):
+            if latency:
+                time.sleep(latency)
+
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+
+            if url.path in ("/v1/acl/policies", "/v1/acl/tokens"):
+                store.count(method, url.path)
+                table = url.path.rsplit("/", 1)[-1]
+                if method != "GET":
+                    return self.reply(405, "method not allowed")
+                if "index" in query:
+                    store.wait_for(
+                        table,
+                        int(query["index"][0]),
+                        parse_duration(query.get("wait", [None])[0]),
+                    )
+                with store.changed:
+                    if table == "policies":
+                        items = [
+                            {k: v for k, v in policy.items() if k != "Rules"}
+                            for policy in store.policies.values()
+                        ]
+                    else:
+                        items = list(store.tokens.values())
+                return self.reply(200, items, table)
+
+            match = DETAIL_PATH.match(url.path)
+            if not match:
+                store.count(method, url.path)
+                return self.reply(404, "not found")
+
+            kind, item_id = match.groups()
+            table = "policies" if kind == "policy" else "tokens"
+            endpoint = f"/v1/acl/{kind}" + ("/{id}" if item_id else "")
+            store.count(method, endpoint)
+
+            try:
+                if method == "GET":
+                    item = getattr(store, table).get(item_id)
+                    if item is None:
+                        return self.reply(403, "ACL not found")
+                    return self.reply(200, item, table)
+                if method == "PUT":
+                    put = store.put_policy if kind == "policy" else store.put_token
+                    return self.reply(200, put(item_id, self.read_body()), table)
+                if method == "DELETE" and item_id:
+                    store.delete(table, item_id)
+                    return self.reply(200, True, table)
+            except LookupError as e:
+                return self.reply(403, str(e))
+            except (KeyError, ValueError) as e:
+                return self.reply(400, str(e))
+
+            return self.reply(405, "method not allowed")
+
+        def do_GET(self):
+            self.dispatch("GET")
+
+        def do_PUT(self):
+            self.dispatch("PUT")
+
+        def do_DELETE(self):
+            self.dispatch("DELETE")
+
+    return Handler
+
+
+class FakeConsul:
+    """
+    Runs the fake API on a background thread.
+
+    Usage::
+
+        with FakeConsul(latency=0.002) as consul:
+            requests.get(consul.url + "/v1/acl/policies")
+            consul.store.requests  # request counter
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.store = AclStore()
+        self.server = ThreadingHTTPServer(
+            (host, port), make_handler(self.store, latency)
+        )
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8500)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    args = parser.parse_args()
+
+    consul = FakeConsul(args.host, args.port, args.latency)
+    print(f"Fake consul ACL API listening on {consul.url}")
+    try:
+        consul.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
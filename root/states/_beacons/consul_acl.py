@@ -0,0 +1,94 @@
+"""
+Beacon that fires an event when the Consul ACL policies or tokens change
+
+Uses the ``consul.watch_acl`` blocking query, so a poll only returns data
+when the ``X-Consul-Index`` of ``acl/policies`` or ``acl/tokens`` has moved
+(or ``wait`` has passed). Beacons run in the minion's main loop, so keep
+``wait`` short and let ``interval`` set the polling rate.
+
+.. code-block:: yaml
+
+    beacons:
+      consul_acl:
+        - interval: 30
+        - wait: 1s
+        - consul_host: http://127.0.0.1:8500
+        - consul_token_pillar: consul:salt_acl_token
+
+The first poll only records the indexes. After that a
+``salt/beacon/<minion_id>/consul_acl/changed`` event is fired with the new
+indexes and the list of changed kinds whenever they move.
+"""
+
+import logging
+
+
+log = logging.getLogger(__name__)
+
+__virtualname__ = "consul_acl"
+
+_INDEX_KEY = "consul_acl.index"
+
+
+def __virtual__():
+    return __virtualname__
+
+
+def _merge_config(config):
+    merged = {}
+    for item in config:
+        merged.update(item)
+    return merged
+
+
+def validate(config):
+    """
+    Validate the beacon configuration
+    """
+
+    if not isinstance(config, list):
+        return False, "Configuration for consul_acl beacon must be a list"
+
+    if not all(isinstance(item, dict) for item in config):
+        return False, "Configuration for consul_acl beacon must be a list of dicts"
+
+    _config = _merge_config(config)
+
+    if "consul_token" in _config and "consul_token_pillar" in _config:
+        return False, "Only one of consul_token and consul_token_pillar may be set"
+
+    return True, "Valid beacon configuration"
+
+
+def beacon(config):
+    """
+    Watch the Consul ACL indexes and fire an event when they change
+    """
+
+    _config = _merge_config(config)
+
+    consul_token = _config.get("consul_token")
+    if "consul_token_pillar" in _config:
+        consul_token = __salt__["pillar.get"](_config["consul_token_pillar"], None)
+
+    last = __context__.get(_INDEX_KEY)
+    try:
+        index = __salt__["consul.watch_acl"](
+            consul_host=_config.get("consul_host"),
+            consul_token=consul_token,
+            index=last,
+            wait=_config.get("wait", "1s"),
+        )
+    except Exception as e:
+        log.warning("Unable to watch consul ACLs: %r", e)
+        return []
+
+    __context__[_INDEX_KEY] = index
+    if last is None:
+        return []
+
+    changed = sorted(kind for kind in index if index[kind] != last.get(kind))
+    if not changed:
+        return []
+
+    return [{"tag": "changed", "changed": changed, "index": index}]
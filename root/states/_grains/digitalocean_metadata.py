@@ -9,22 +9,259 @@
     See https://developers.digitalocean.com/metadata/#metadata-in-json
     Note that not all datacenters were supported when this feature was first
     released.
+
+    The metadata is cached in the minion cachedir for
+    ``digitalocean_metadata_ttl`` seconds (default 3600). Once that expires it
+    is revalidated with ETag/If-Modified-Since, and if the metadata server
+    can't be reached within ``digitalocean_metadata_timeout`` seconds the
+    cached copy is used as-is. Hosts whose DMI vendor is not DigitalOcean, or
+    can't be read, never contact the metadata server unless
+    ``digitalocean_metadata_force`` is set.
+
+    To keep the grain small, set ``digitalocean_metadata_paths`` to a list of
+    per-key metadata paths, e.g. ``[tags, region, interfaces/private]``. Only
+    those are fetched, concurrently, from ``/metadata/v1/<path>``, and the
+    grain holds just that subtree, shaped like the JSON document (``-`` in
+    names becomes ``_``, interface ``address`` keys become ``ip_address``, and
+    numbered directories such as ``interfaces/private/0/`` become lists). End
+    a path with ``/`` if it is a directory whose entries are all plain keys.
+    ``tags`` is always fetched, since the ``roles`` grain comes from it. If it
+    can't be fetched the cached grain is kept; any other path that fails is
+    left out, and that incomplete grain is not cached.
 """
 from __future__ import absolute_import
 
 # Import Python Libs
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
+log = logging.getLogger(__name__)
+
+METADATA_URL = "http://169.254.169.254/metadata/v1.json"
+METADATA_KEY_URL = "http://169.254.169.254/metadata/v1/"
+# Per-key paths whose listing is a list of values rather than of keys
+LIST_PATHS = ("tags", "public-keys", "dns/nameservers", "features")
+# Paths the grain can't do without: the roles grain, and so top.sls targeting
+# and the role pillar layers, come from tags
+REQUIRED_PATHS = ("tags",)
+# Per-key names that the JSON document calls something else, by the top level
+# directory they are under
+KEY_NAMES = {"interfaces": {"address": "ip_address"}}
+MAX_WORKERS = 8
+DMI_VENDOR_PATH = "/sys/class/dmi/id/sys_vendor"
+CACHE_FILE = "digitalocean_metadata.json"
+DEFAULT_TTL = 3600
+# The metadata server is link-local, so it either answers straight away or
+# isn't there at all.
+DEFAULT_CONNECT_TIMEOUT = 0.5
+DEFAULT_READ_TIMEOUT = 2
+
+
+def _is_digitalocean():
+    """
+    Returns True if the DMI vendor shows this is a DigitalOcean droplet, or
+    ``digitalocean_metadata_force`` is set. A vendor that can't be read (e.g.
+    in a container) counts as not DigitalOcean.
+    """
+
+    if __opts__.get("digitalocean_metadata_force", False):
+        return True
+    try:
+        with open(DMI_VENDOR_PATH) as f:
+            return f.read().strip() == "DigitalOcean"
+    except (IOError, OSError):
+        return False
+
+
+def _cache_path():
+    return os.path.join(__opts__["cachedir"], CACHE_FILE)
+
+
+def _read_cache():
+    try:
+        with open(_cache_path()) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_cache(cache):
+    path = _cache_path()
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".do-metadata")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, path)
+    except (IOError, OSError) as e:
+        log.debug("Could not write DigitalOcean metadata cache %s: %s", path, e)
+
+
+def _timeout():
+    return (
+        __opts__.get("digitalocean_metadata_timeout", DEFAULT_CONNECT_TIMEOUT),
+        DEFAULT_READ_TIMEOUT,
+    )
+
+
+def _insert(tree, path, value):
+    keys = [key.replace("-", "_") for key in path.strip("/").split("/")]
+    names = KEY_NAMES.get(keys[0], {})
+    keys = keys[:1] + [names.get(key, key) for key in keys[1:]]
+    for key in keys[:-1]:
+        tree = tree.setdefault(key, {})
+    tree[keys[-1]] = value
+
+
+def _listify(tree):
+    """
+    Turns directories keyed "0", "1", ... into lists, recursively.
+    """
+
+    if not isinstance(tree, dict):
+        return tree
+    tree = {key: _listify(value) for key, value in tree.items()}
+    if tree and all(key.isdigit() for key in tree):
+        return [tree[key] for key in sorted(tree, key=int)]
+    return tree
+
+
+def _fetch_paths(paths):
+    """
+    Fetches the given per-key metadata paths, walking into directories. Each
+    level of the tree is fetched concurrently.
+
+    An optional path the server answers with an error (e.g. a 404) is left
+    out of the tree, and the others are kept. An error on one of
+    `REQUIRED_PATHS` fails the whole fetch.
+
+    Returns:
+        A tuple of the metadata subtree for ``paths`` and whether any
+        optional path was left out, or None if the metadata server could not
+        be reached or a required path could not be fetched
+    """
+
+    tree = {}
+    partial = False
+    pending = list(paths)
+    with requests.Session() as session, ThreadPoolExecutor(MAX_WORKERS) as pool:
+
+        def get(path):
+            try:
+                resp = session.get(METADATA_KEY_URL + path, timeout=_timeout())
+                resp.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout):
+                raise
+            except requests.RequestException as e:
+                log.debug("Skipping DigitalOcean metadata path %s: %s", path, e)
+                return None
+            return resp.text
+
+        while pending:
+            try:
+                texts = list(pool.map(get, pending))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                log.debug("DigitalOcean metadata server unavailable: %s", e)
+                return None
+
+            fetched, pending = pending, []
+            for path, text in zip(fetched, texts):
+                if text is None:
+                    if path.strip("/") in REQUIRED_PATHS:
+                        log.debug("Required DigitalOcean metadata %s missing", path)
+                        return None
+                    partial = True
+                    continue
+                lines = text.splitlines()
+                if path.strip("/") in LIST_PATHS:
+                    _insert(tree, path, lines)
+                elif path.endswith("/") or any(line.endswith("/") for line in lines):
+                    directory = path.rstrip("/") + "/"
+                    pending.extend(directory + line for line in lines if line)
+                else:
+                    _insert(tree, path, text.strip())
+
+    return _listify(tree), partial
+
+
+def _fetch(cache, paths):
+    """
+    Fetches the metadata document, revalidating ``cache`` if there is one, or
+    just ``paths`` if they are given.
+
+    Returns:
+        The new cache entry, or None if the metadata server could not be
+        reached or did not return the document
+    """
+
+    if paths:
+        fetched = _fetch_paths(paths)
+        if fetched is None:
+            return None
+        metadata, partial = fetched
+        return {
+            "fetched": time.time(),
+            "paths": paths,
+            "metadata": metadata,
+            "partial": partial,
+        }
+
+    headers = {}
+    if cache and cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache and cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    try:
+        resp = requests.get(METADATA_URL, headers=headers, timeout=_timeout())
+    except requests.RequestException as e:
+        log.debug("DigitalOcean metadata server unavailable: %s", e)
+        return None
+
+    if resp.status_code == 304 and cache:
+        return dict(cache, fetched=time.time())
+    if resp.status_code != 200:
+        return None
+
+    return {
+        "fetched": time.time(),
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "metadata": resp.json(),
+    }
+
 
 def digitalocean():
     """
     Return DigitalOcean metadata.
     """
-    do_svr = "http://169.254.169.254/metadata/v1.json"
-    metadata = requests.get(do_svr)
 
-    if metadata.status_code == 200:
-        meta = metadata.json()
-        return {"digitalocean": meta, "roles": meta.get("tags", [])}
+    if not _is_digitalocean():
+        return {"digitalocean": []}
+
+    paths = list(__opts__.get("digitalocean_metadata_paths") or []) or None
+    if paths and "tags" not in [p.strip("/") for p in paths]:
+        paths.append("tags")
+    cache = _read_cache()
+    if cache is not None and cache.get("paths") != paths:
+        cache = None
+
+    ttl = __opts__.get("digitalocean_metadata_ttl", DEFAULT_TTL)
+    if cache is None or time.time() - cache.get("fetched", 0) >= ttl:
+        fresh = _fetch(cache, paths)
+        if fresh is not None:
+            cache = fresh
+            # Used for this load only, so the missing paths are tried again
+            if not cache.get("partial"):
+                _write_cache(cache)
+
+    if cache is None:
+        return {"digitalocean": []}
 
-    return {"digitalocean": []}
+    meta = cache["metadata"]
+    return {"digitalocean": meta, "roles": meta.get("tags", [])}
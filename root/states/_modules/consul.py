@@ -1,21 +1,86 @@
 """
 Exec module for various consul operations
+
+By default all calls go through a pooled `requests` session. Setting the
+``consul:backend`` config to ``asyncio`` switches to a transport that runs
+every request on a single asyncio event loop with aiohttp, bounded by
+``consul:concurrency`` in-flight requests. If aiohttp is not installed the
+default backend is used instead.
+
+Requests time out after ``consul:connect_timeout`` / ``consul:read_timeout``
+seconds. Transient failures (connection errors, timeouts and 5xx responses) of
+GET and PUT requests are retried up to ``consul:retries`` times with jittered
+exponential backoff, and after ``consul:breaker_threshold`` failed requests in
+a row calls to that agent fail fast for ``consul:breaker_reset`` seconds.
 """
 
+import asyncio
+import atexit
+import bisect
+import contextvars
+import functools
+import hashlib
+import json
 import logging
 import os
+import random
+import re
+import sys
+import threading
+import time
+import types
 import uuid
-from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as wait_futures
+from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from salt import exceptions
 
+try:
+    import aiohttp
+
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+# Errors worth retrying: the agent could not be reached or did not answer in
+# time.
+_TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout)
+if HAS_AIOHTTP:
+    _TRANSIENT_ERRORS += (aiohttp.ClientError, asyncio.TimeoutError)
+
 
 log = logging.getLogger(__name__)
 
 
 CONSUL_DEFAULT_HOST = "http://127.0.0.1:8500"
 CONSUL_DEFAULT_TOKEN = None
+CONSUL_DEFAULT_POOL_SIZE = 10
+CONSUL_DEFAULT_POOL_IDLE_TIMEOUT = 60
+CONSUL_DEFAULT_BACKEND = "requests"
+CONSUL_DEFAULT_CONCURRENCY = 32
+CONSUL_DEFAULT_NEGATIVE_CACHE_TTL = 30
+CONSUL_DEFAULT_WATCH_WAIT = "5m"
+CONSUL_DEFAULT_CONNECT_TIMEOUT = 3.05
+CONSUL_DEFAULT_READ_TIMEOUT = 10
+CONSUL_DEFAULT_RETRIES = 3
+CONSUL_DEFAULT_RETRY_BACKOFF = 0.25
+CONSUL_DEFAULT_RETRY_BACKOFF_MAX = 5
+CONSUL_DEFAULT_BREAKER_THRESHOLD = 5
+CONSUL_DEFAULT_BREAKER_RESET = 30
+
+# Methods that are safe to send again: reads, and PUTs to an object's own ID
+# (updates, agent registrations), which converge on the same object. Creates
+# are sent with ``retry=False``; see `_send_step`.
+RETRY_METHODS = ("GET", "PUT")
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Stands in for token secrets in changes and in the plans `plan` returns
+REDACTED = "<hidden>"
 
 
 NAMESPACE_CONSUL = uuid.uuid5(
@@ -72,53 +137,904 @@ def _get_connection_params(host, token):
     return (host, token)
 
 
-def get_session(host, token):
+class RequestStats:
+    """
+    Per-endpoint counters for the requests made to Consul: request counts,
+    status codes, connection errors, retries, bytes sent and received, and a
+    latency histogram. Endpoints are named by method and path, with IDs
+    replaced by ``{id}`` (e.g. ``GET acl/policy/{id}``).
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = {
+                "requests": 0,
+                "errors": 0,
+                "retries": 0,
+                "seconds": 0.0,
+                "bytes_sent": 0,
+                "bytes_received": 0,
+                "status": {},
+                "latency": [0] * (len(self.LATENCY_BUCKETS) + 1),
+            }
+        return self.endpoints[endpoint]
+
+    def record(self, endpoint, status, seconds, bytes_sent, bytes_received):
+        """
+        Records one request. ``status`` is `None` if no response was received.
+        """
+
+        with self.lock:
+            counters = self._endpoint(endpoint)
+            counters["requests"] += 1
+            if status is None:
+                counters["errors"] += 1
+            else:
+                counters["status"][status] = counters["status"].get(status, 0) + 1
+            counters["seconds"] += seconds
+            counters["bytes_sent"] += bytes_sent
+            counters["bytes_received"] += bytes_received
+            counters["latency"][bisect.bisect_left(self.LATENCY_BUCKETS, seconds)] += 1
+
+    def record_retry(self, endpoint):
+        with self.lock:
+            self._endpoint(endpoint)["retries"] += 1
+
+    def report(self):
+        """
+        Returns:
+            A dict of totals plus an ``endpoints`` dict of per-endpoint counters.
+            Latency histograms only list non-empty buckets, keyed by their upper
+            bound in seconds.
+        """
+
+        labels = [f"<={bound}s" for bound in self.LATENCY_BUCKETS]
+        labels.append(f">{self.LATENCY_BUCKETS[-1]}s")
+
+        totals = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "seconds": 0.0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+        }
+        endpoints = {}
+        with self.lock:
+            for endpoint, counters in self.endpoints.items():
+                for key in totals:
+                    totals[key] += counters[key]
+                endpoints[endpoint] = dict(
+                    counters,
+                    seconds=round(counters["seconds"], 6),
+                    status=dict(counters["status"]),
+                    latency={
+                        label: count
+                        for label, count in zip(labels, counters["latency"])
+                        if count
+                    },
+                )
+
+        totals["seconds"] = round(totals["seconds"], 6)
+        totals["endpoints"] = endpoints
+        return totals
+
+
+_ENDPOINT_IDS = re.compile(
+    r"(?<=/)[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?=/|$)"
+)
+
+
+def _endpoint_name(method, url):
+    return f"{method.upper()} {_ENDPOINT_IDS.sub('{id}', url.split('?', 1)[0])}"
+
+
+def _run_context():
+    """
+    Returns ``__context__``, first dropping this module's per-run entries if
+    another process made them. Minion jobs are forked from the minion
+    process, where the consul_acl beacon's requests are counted and cached,
+    so a job would otherwise start with everything the beacon did since the
+    minion started.
+    """
+
+    pid = os.getpid()
+    if __context__.get("consul.pid") != pid:
+        for key in [k for k in __context__ if str(k).startswith("consul.")]:
+            del __context__[key]
+        __context__["consul.pid"] = pid
+    return __context__
+
+
+def _run_stats():
+    context = _run_context()
+    stats = context.get("consul.stats")
+    if stats is None:
+        stats = context.setdefault("consul.stats", RequestStats())
+    return stats
+
+
+def _record_request(endpoint, status, seconds, bytes_sent, bytes_received):
+    for stats in (_POOL.stats, _run_stats()):
+        stats.record(endpoint, status, seconds, bytes_sent, bytes_received)
+
+
+def _record_retry(endpoint):
+    for stats in (_POOL.stats, _run_stats()):
+        stats.record_retry(endpoint)
+
+
+class RetryPolicy:
+    """
+    How often and how long to wait before resending a failed request. Delays
+    use "full jitter" exponential backoff: a random time between 0 and
+    ``backoff * 2 ** (attempt - 1)``, capped at ``backoff_max`` seconds.
+    """
+
+    def __init__(self, retries, backoff, backoff_max):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt):
+        ceiling = min(self.backoff_max, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
     """
-    Instantiates a new requests Session object from the host and token.
+    Stops sending requests to an agent after ``threshold`` failed requests in a
+    row. Once ``reset_timeout`` seconds have passed a single request is let
+    through; if it succeeds the breaker closes again, otherwise it stays open
+    for another ``reset_timeout``.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    log.warning(
+                        "Consul requests failing, pausing them for %ss",
+                        self.reset_timeout,
+                    )
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class _ConsulSessionMixin:
+    """
+    Behaviour shared by the session backends: idle tracking, timeouts, retries,
+    the circuit breaker and request instrumentation. Backends implement
+    ``_send(method, url, timeout, **kwargs)``, where ``url`` is relative to
+    ``base_url`` and ``timeout`` is a (connect, read) tuple in seconds.
+
+    A session with requests in flight (e.g. a blocking `watch_acl` query) is
+    never idle, and its idle time counts from when the last one finished.
+    """
+
+    def request(self, method, url, timeout=None, retry=True, **kwargs):
+        """
+        Sends a request, retrying transient failures of `RETRY_METHODS`.
+
+        Args:
+            timeout: (connect, read) timeouts in seconds, overriding the
+                session's for this request (e.g. for blocking queries)
+            retry: Set to False for requests that aren't safe to send twice
+
+        Returns:
+            The last response; a 5xx response is returned once retries are
+            exhausted so callers still see it in ``raise_for_status``
+
+        Raises:
+            salt.exceptions.CommandExecutionError: if the circuit breaker is open,
+                or the session was closed (e.g. evicted while idle)
+        """
+
+        if self.closed:
+            raise exceptions.CommandExecutionError(
+                f"The consul session for {self.base_url} is closed; "
+                "get a new one with get_session"
+            )
+        with self._in_flight_lock:
+            self.in_flight += 1
+            self.last_used = time.monotonic()
+        try:
+            return self._request_with_retry(method, url, timeout, retry, kwargs)
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+                self.last_used = time.monotonic()
+
+    def _request_with_retry(self, method, url, timeout, retry, kwargs):
+        endpoint = _endpoint_name(method, url)
+        if not self.breaker.allow():
+            raise exceptions.CommandExecutionError(
+                f"Not sending {endpoint} to {self.base_url}: too many recent "
+                f"failures, waiting {self.breaker.reset_timeout}s before retrying"
+            )
+
+        retries = 0
+        if retry and method.upper() in RETRY_METHODS:
+            retries = self.retry.retries
+        try:
+            for attempt in range(retries + 1):
+                if attempt:
+                    _record_retry(endpoint)
+                    time.sleep(self.retry.delay(attempt))
+                resp, error = self._attempt(
+                    endpoint, method, url, timeout or self.timeout, kwargs
+                )
+                if error is None and resp.status_code not in RETRY_STATUSES:
+                    self.breaker.success()
+                    return resp
+                log.debug(
+                    "Consul request %s failed (attempt %s of %s): %s",
+                    endpoint,
+                    attempt + 1,
+                    retries + 1,
+                    error or resp.status_code,
+                )
+        except Exception:
+            # Any other error still counts, so a failed half-open probe
+            # reopens the breaker instead of leaving it probing forever
+            self.breaker.failure()
+            raise
+
+        self.breaker.failure()
+        if error is not None:
+            raise error
+        return resp
+
+    def _attempt(self, endpoint, method, url, timeout, kwargs):
+        """
+        Sends one request and records it.
+
+        Returns:
+            A tuple of (response, None), or (None, error) for a transient error
+        """
+
+        bytes_sent = len(json.dumps(kwargs["json"])) if "json" in kwargs else 0
+        start = time.monotonic()
+        try:
+            resp = self._send(method, url, timeout=timeout, **kwargs)
+        except _TRANSIENT_ERRORS as e:
+            _record_request(endpoint, None, time.monotonic() - start, bytes_sent, 0)
+            return None, e
+        except Exception:
+            _record_request(endpoint, None, time.monotonic() - start, bytes_sent, 0)
+            raise
+
+        _record_request(
+            endpoint,
+            resp.status_code,
+            time.monotonic() - start,
+            bytes_sent,
+            len(resp.content),
+        )
+        return resp, None
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def is_idle(self, now):
+        if self.idle_timeout is None:
+            return False
+        with self._in_flight_lock:
+            return not self.in_flight and now - self.last_used > self.idle_timeout
+
+
+class ConsulSession(_ConsulSessionMixin, requests.Session):
+    """
+    A `requests.Session` bound to a single Consul agent.
 
     This Session behaves like BaseUrlSession from requests_toolbelt, so
-    only the path is required to be given to request methods. It also
-    appends "/v1/" to the end of the host, if absent, so that path portion
-    is not required.
+    only the path is required to be given to request methods. Connections
+    are kept alive in a pool of up to ``pool_size`` connections.
+    """
+
+    def __init__(
+        self, base_url, token, pool_size, idle_timeout, timeout, retry, breaker
+    ):
+        super().__init__()
+        self.base_url = base_url
+        self.token = token
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.retry = retry
+        self.breaker = breaker
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.closed = False
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+        if token:
+            self.headers.update({"X-Consul-Token": token})
+
+    def _send(self, method, url, timeout, **kwargs):
+        return requests.Session.request(
+            self, method, self.base_url + url, timeout=timeout, **kwargs
+        )
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+class AsyncResponse:
+    """
+    The parts of `requests.Response` this module uses, for responses read by
+    `AsyncConsulSession`.
+    """
+
+    def __init__(self, method, url, status_code, headers, content):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(
+                f"{self.status_code} Error: {self.content!r} for url: {self.url}",
+                response=self,
+            )
+
+
+class AsyncConsulSession(_ConsulSessionMixin):
+    """
+    A session bound to a single Consul agent that sends every request through
+    aiohttp on a private event loop thread.
+
+    It exposes the same blocking ``request``/``get``/``put``/``delete`` calls as
+    `ConsulSession`, so the rest of this module is unchanged. Callers on many
+    threads (see `_run_concurrently`) share the loop, which keeps up to
+    ``concurrency`` requests in flight over one connection pool.
+    """
+
+    def __init__(
+        self, base_url, token, concurrency, idle_timeout, timeout, retry, breaker
+    ):
+        self.base_url = base_url
+        self.token = token
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.retry = retry
+        self.breaker = breaker
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.closed = False
+        self.headers = {"X-Consul-Token": token} if token else {}
+        # Requests that have been sent, to tell a busy loop from a stuck one
+        self._started = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="consul-asyncio", daemon=True
+        )
+        self._thread.start()
+        self._run(self._start(concurrency), self.timeout)
+
+    def _run(self, coro, timeout):
+        """
+        Runs ``coro`` on the loop thread, waiting at most the sum of the
+        (connect, read) ``timeout`` plus a second for it, so a caller can't
+        hang on a loop that is gone or stuck.
+        """
+
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(sum(timeout) + 1)
+        except FutureTimeoutError:
+            future.cancel()
+            raise requests.Timeout(
+                f"No answer from the consul event loop for {self.base_url} "
+                f"within {sum(timeout) + 1}s"
+            )
+
+    async def _start(self, concurrency):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency), headers=self.headers
+        )
+
+    async def _request(self, method, url, timeout, started, params=None, json=None):
+        connect, read = timeout
+        async with self._semaphore:
+            # The deadline only starts once a request is sent; time spent
+            # queued behind ``concurrency`` others doesn't count against it
+            self._started += 1
+            started.set()
+            return await asyncio.wait_for(
+                self._fetch(method, url, connect, read, params, json),
+                sum(timeout) + 1,
+            )
+
+    async def _fetch(self, method, url, connect, read, params, json):
+        async with self._client.request(
+            method,
+            self.base_url + url,
+            params=params,
+            json=json,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+        ) as resp:
+            content = await resp.read()
+            return AsyncResponse(
+                method,
+                str(resp.url),
+                resp.status,
+                CaseInsensitiveDict(resp.headers),
+                content,
+            )
+
+    def _send(self, method, url, timeout, params=None, json=None):
+        """
+        Sends a request on the loop thread. A request still queued for the
+        semaphore is waited for as long as other requests keep being sent;
+        one that was sent has its own deadline (see `_request`), and is given
+        up on here only if the loop doesn't enforce it.
+        """
+
+        started = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._request(method, url, timeout, started, params=params, json=json),
+            self._loop,
+        )
+        wait = sum(timeout) + 2
+        progress = self._started
+        was_started = False
+        while True:
+            try:
+                return future.result(wait)
+            except FutureTimeoutError:
+                # Sent before this wait began and still no answer, or nothing
+                # else was sent during it either
+                if was_started or self._started == progress:
+                    future.cancel()
+                    raise requests.Timeout(
+                        f"No answer from the consul event loop for {self.base_url} "
+                        f"within {wait}s"
+                    )
+                was_started = started.is_set()
+                progress = self._started
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._run(self._client.close(), self.timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(sum(self.timeout))
+            if not self._thread.is_alive():
+                self._loop.close()
+
+
+def _backend():
+    """
+    Returns the transport backend to use for this run, from the
+    ``consul:backend`` config.
+    """
+
+    context = _run_context()
+    if "consul.backend" not in context:
+        backend = __salt__["config.get"]("consul:backend", CONSUL_DEFAULT_BACKEND)
+        if backend not in ("requests", "asyncio"):
+            raise exceptions.SaltInvocationError(
+                f"Unknown consul:backend {backend!r}, expected requests or asyncio"
+            )
+        if backend == "asyncio" and not HAS_AIOHTTP:
+            log.warning("aiohttp is not installed, using the requests consul backend")
+            backend = "requests"
+        context["consul.backend"] = backend
+    return context["consul.backend"]
+
+
+def _forget_sessions_after_fork(pool):
+    pool.inherited.extend(pool.sessions.values())
+    pool.sessions.clear()
+    # The parent may have held the lock when it forked
+    pool.lock = threading.Lock()
+
+
+def _close_sessions(pool):
+    """
+    Closes every pooled session, so the asyncio backend's client sessions are
+    closed properly when the process exits.
+    """
+
+    with pool.lock:
+        sessions = list(pool.sessions.values())
+        pool.sessions.clear()
+    for session in sessions:
+        try:
+            session.close()
+        except Exception as e:
+            log.debug("Could not close consul session for %s: %s", session.base_url, e)
+
+
+def _create_pool():
+    pool = types.ModuleType(_POOL_MODULE)
+
+    # Pooled sessions, keyed by (backend, host, token). These live for the
+    # lifetime of the minion process so that keep-alive connections are reused
+    # across calls and state runs; idle ones are evicted by `get_session`.
+    pool.sessions = {}
+    pool.lock = threading.Lock()
+
+    # Sessions a forked process inherited from its parent, e.g. a job forked
+    # from the minion process after the consul_acl beacon made requests. They
+    # share the parent's sockets, so the child never uses them; they are only
+    # kept referenced so that nothing tries to clean them up from here.
+    pool.inherited = []
+
+    # Circuit breakers, keyed by base URL, shared by every session for that
+    # agent.
+    pool.breakers = {}
+
+    # Token accessors known not to exist, keyed by (base_url, accessor) with
+    # the monotonic time the entry expires at. See `token_by_name_or_accessor`.
+    pool.absent_tokens = {}
+    pool.absent_tokens_lock = threading.Lock()
+
+    # Counters for the whole life of this process; each run also gets its own
+    # RequestStats in __context__.
+    pool.stats = RequestStats()
+    return pool
+
+
+# State shared by the whole process. The loader executes this file into a new
+# module object every time it loads it, so module globals only last until the
+# next refresh; keep the pool on a module registered in sys.modules instead,
+# and register its fork and exit hooks only when it is first created.
+_POOL_MODULE = "salt_ext_consul_pool"
+_POOL = sys.modules.get(_POOL_MODULE)
+if _POOL is None:
+    _new_pool = _create_pool()
+    _POOL = sys.modules.setdefault(_POOL_MODULE, _new_pool)
+    if _POOL is _new_pool:
+        os.register_at_fork(
+            after_in_child=functools.partial(_forget_sessions_after_fork, _POOL)
+        )
+        atexit.register(_close_sessions, _POOL)
+    del _new_pool
+
+
+def _evict_idle_sessions():
+    """
+    Closes and forgets any pooled sessions that have not been used within
+    their idle timeout, and forgets ones closed elsewhere. Must be called with
+    ``_POOL.lock`` held.
+    """
+
+    now = time.monotonic()
+    for key, session in list(_POOL.sessions.items()):
+        if session.closed:
+            del _POOL.sessions[key]
+        elif session.is_idle(now):
+            log.debug("Closing idle consul session for %s", session.base_url)
+            del _POOL.sessions[key]
+            session.close()
+
+
+def get_session(host, token):
+    """
+    Returns the pooled Session for the host and token, creating it if this is
+    the first call for that pair.
+
+    The connection params are resolved once per run and cached in
+    ``__context__``. Pool sizing is controlled with the ``consul:pool_size``
+    config (or ``consul:concurrency`` for the asyncio backend), and sessions
+    that have been unused for ``consul:pool_idle_timeout`` seconds are closed
+    (set it to ``None`` to keep them forever). Timeout, retry and circuit
+    breaker settings are described in the module docstring.
 
     Args:
         host: consul connection string
         token: consul token
 
     Returns:
-        A `requests.Session` object
+        A `ConsulSession`, or an `AsyncConsulSession` if ``consul:backend`` is
+        ``asyncio``
+    """
+
+    params = _run_context().setdefault("consul.connection_params", {})
+    if (host, token) not in params:
+        params[(host, token)] = _get_connection_params(host, token)
+    resolved_host, resolved_token = params[(host, token)]
+    backend = _backend()
+
+    with _POOL.lock:
+        _evict_idle_sessions()
+
+        session = _POOL.sessions.get((backend, resolved_host, resolved_token))
+        if session is not None:
+            # Keep it from being evicted before the caller sends its request
+            session.last_used = time.monotonic()
+        else:
+            # Ensure the URL ends with a single / so urljoin doesn't
+            # eat part of the pathname, and append the api path if missing
+            base_url = resolved_host.rstrip("/") + "/"
+            if "/v1/" not in base_url:
+                base_url = base_url + "v1/"
+
+            breaker = _POOL.breakers.get(base_url)
+            if breaker is None:
+                breaker = _POOL.breakers[base_url] = CircuitBreaker(
+                    __salt__["config.get"](
+                        "consul:breaker_threshold", CONSUL_DEFAULT_BREAKER_THRESHOLD
+                    ),
+                    __salt__["config.get"](
+                        "consul:breaker_reset", CONSUL_DEFAULT_BREAKER_RESET
+                    ),
+                )
+            options = {
+                "idle_timeout": __salt__["config.get"](
+                    "consul:pool_idle_timeout", CONSUL_DEFAULT_POOL_IDLE_TIMEOUT
+                ),
+                "timeout": (
+                    __salt__["config.get"](
+                        "consul:connect_timeout", CONSUL_DEFAULT_CONNECT_TIMEOUT
+                    ),
+                    __salt__["config.get"](
+                        "consul:read_timeout", CONSUL_DEFAULT_READ_TIMEOUT
+                    ),
+                ),
+                "retry": RetryPolicy(
+                    __salt__["config.get"]("consul:retries", CONSUL_DEFAULT_RETRIES),
+                    __salt__["config.get"](
+                        "consul:retry_backoff", CONSUL_DEFAULT_RETRY_BACKOFF
+                    ),
+                    __salt__["config.get"](
+                        "consul:retry_backoff_max", CONSUL_DEFAULT_RETRY_BACKOFF_MAX
+                    ),
+                ),
+                "breaker": breaker,
+            }
+            if backend == "asyncio":
+                session = AsyncConsulSession(
+                    base_url,
+                    resolved_token,
+                    concurrency=__salt__["config.get"](
+                        "consul:concurrency", CONSUL_DEFAULT_CONCURRENCY
+                    ),
+                    **options,
+                )
+            else:
+                session = ConsulSession(
+                    base_url,
+                    resolved_token,
+                    pool_size=__salt__["config.get"](
+                        "consul:pool_size", CONSUL_DEFAULT_POOL_SIZE
+                    ),
+                    **options,
+                )
+            _POOL.sessions[(backend, resolved_host, resolved_token)] = session
+
+    return session
+
+
+class AclSnapshot:
+    """
+    An indexed copy of one of Consul's ACL list endpoints, loaded once per run
+    and kept up to date in place as this module creates, updates and deletes
+    objects.
+
+    ``by_id`` maps the object ID (policy ID or token AccessorID) to the list
+    stub, ``by_name`` maps policy names to IDs and ``details`` holds the full
+    objects already read or written during this run. ``index`` is the
+    ``X-Consul-Index`` the list was read at.
+    """
+
+    def __init__(self, items, index, id_key):
+        self.index = index
+        self.id_key = id_key
+        self.lock = threading.RLock()
+        self.by_id = {}
+        self.by_name = {}
+        self.details = {}
+        for item in items:
+            self.put(item)
+
+    def put(self, item, detail=False):
+        item_id = item[self.id_key]
+        with self.lock:
+            old = self.by_id.get(item_id)
+            if old is not None and "Name" in old:
+                self.by_name.pop(old["Name"], None)
+
+            self.by_id[item_id] = item
+            if "Name" in item:
+                self.by_name[item["Name"]] = item_id
+
+            if detail:
+                self.details[item_id] = item
+            else:
+                self.details.pop(item_id, None)
+
+    def remove(self, item_id):
+        with self.lock:
+            item = self.by_id.pop(item_id, None)
+            if item is not None and "Name" in item:
+                self.by_name.pop(item["Name"], None)
+            self.details.pop(item_id, None)
+
+    def values(self):
+        with self.lock:
+            return list(self.by_id.values())
+
+
+_ACL_LIST_ENDPOINTS = {"policies": "acl/policies", "tokens": "acl/tokens"}
+_ACL_DETAIL_ENDPOINTS = {"policies": "acl/policy", "tokens": "acl/token"}
+_ACL_ID_KEYS = {"policies": "ID", "tokens": "AccessorID"}
+_SNAPSHOTS_LOCK = threading.RLock()
+
+
+def _acl_snapshot(session, kind, refresh=False):
+    """
+    Returns the `AclSnapshot` of ``kind`` ("policies" or "tokens") for this
+    session, loading it with a single list call the first time it is needed in
+    a run.
+
+    Snapshots are stored in ``__context__``, so they never outlive the run. If
+    ``refresh`` is set the list is read again, and the snapshot is rebuilt
+    only if the returned ``X-Consul-Index`` differs from the one it was
+    loaded at.
+    """
+
+    snapshots = _run_context().setdefault("consul.acl_snapshots", {})
+    key = (session.base_url, session.token, kind)
+
+    with _SNAPSHOTS_LOCK:
+        snapshot = snapshots.get(key)
+
+        if snapshot is None or refresh:
+            resp = session.get(_ACL_LIST_ENDPOINTS[kind])
+            resp.raise_for_status()
+            index = resp.headers.get("X-Consul-Index")
+
+            if snapshot is None or index is None or snapshot.index != index:
+                snapshot = AclSnapshot(resp.json(), index, _ACL_ID_KEYS[kind])
+                snapshots[key] = snapshot
+
+    return snapshot
+
+
+def _loaded_acl_snapshot(session, kind):
+    """
+    Returns the `AclSnapshot` of ``kind`` for this session if it has already
+    been loaded this run, or `None`. Used to keep a snapshot current after a
+    write without forcing a list call just to do so.
+    """
+
+    snapshots = _run_context().get("consul.acl_snapshots", {})
+    return snapshots.get((session.base_url, session.token, kind))
+
+
+def _acl_detail(session, kind, item_id):
+    """
+    Reads the full object for an ID listed in the ``kind`` snapshot, reusing
+    the copy in the snapshot if it was already read or written this run.
+
+    Returns:
+        The object dict, or `None` if the ID is not (or no longer) present
     """
 
-    host, token = _get_connection_params(host, token)
+    snapshot = _acl_snapshot(session, kind)
+    if item_id not in snapshot.by_id:
+        return None
+    if item_id in snapshot.details:
+        return snapshot.details[item_id]
+
+    resp = session.get(f"{_ACL_DETAIL_ENDPOINTS[kind]}/{item_id}")
+    if resp.status_code in (403, 404):
+        # Consul answers 403 rather than 404 for missing ACL objects, so this
+        # is either a permissions problem or the snapshot has gone stale.
+        # Re-list to find out which.
+        snapshot = _acl_snapshot(session, kind, refresh=True)
+        if item_id not in snapshot.by_id:
+            return None
+    resp.raise_for_status()
 
-    # Ensure the URL ends with a single / so urljoin doesn't
-    # eat part of the pathname, and append the api path if missing
-    host = host.rstrip("/") + "/"
-    if "/v1/" not in host:
-        host = host + "v1/"
+    item = resp.json()
+    snapshot.put(item, detail=True)
+    return item
 
-    def new_req(host, f, method, url, *args, **kwargs):
-        return f(method, host + url, *args, **kwargs)
 
-    s = requests.Session()
-    if token:
-        s.headers.update({"X-Consul-Token": token})
-    s.request = partial(new_req, host, s.request)
+def _run_concurrently(func, items):
+    """
+    Calls ``func`` on each of ``items`` over a thread pool of at most
+    ``consul:max_workers`` threads, returning the results in order.
+
+    Every task runs in a copy of the caller's context so the salt loader
+    dunders resolve the same way they do in the calling thread. All threads
+    share the pooled session, so by default there are as many workers as the
+    session can have requests in flight: ``consul:pool_size`` connections, or
+    ``consul:concurrency`` with the asyncio backend.
+    """
+
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
 
-    return s
+    max_workers = __salt__["config.get"]("consul:max_workers", None)
+    if max_workers is None:
+        if _backend() == "asyncio":
+            max_workers = __salt__["config.get"](
+                "consul:concurrency", CONSUL_DEFAULT_CONCURRENCY
+            )
+        else:
+            max_workers = __salt__["config.get"](
+                "consul:pool_size", CONSUL_DEFAULT_POOL_SIZE
+            )
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, func, item) for item in items
+        ]
+        return [future.result() for future in futures]
 
 
 def all_policies(consul_host, consul_token):
     """
     Returns a list of all policies from consul.
 
+    This always reads the list from consul, and refreshes the run's cached
+    policy snapshot if it has changed.
+
     See: https://www.consul.io/api/acl/policies.html#list-policies
     """
 
-    resp = get_session(consul_host, consul_token).get("acl/policies")
-    resp.raise_for_status()
-    json = resp.json()
-    return json
+    session = get_session(consul_host, consul_token)
+    return _acl_snapshot(session, "policies", refresh=True).values()
 
 
 def policy_from_name(name, consul_host, consul_token):
@@ -131,15 +1047,98 @@ def policy_from_name(name, consul_host, consul_token):
     See: https://www.consul.io/api/acl/policies.html#read-a-policy
     """
 
-    policy = [p for p in all_policies(consul_host, consul_token) if p["Name"] == name]
-    if not policy:
+    session = get_session(consul_host, consul_token)
+    policy_id = _acl_snapshot(session, "policies").by_name.get(name)
+    if policy_id is None:
         return None
 
-    policy = policy.pop()
-    policy_id = policy["ID"]
-    resp = get_session(consul_host, consul_token).get(f"acl/policy/{policy_id}")
-    resp.raise_for_status()
-    return resp.json()
+    return _acl_detail(session, "policies", policy_id)
+
+
+def _policy_changes(existing, name, rules, description):
+    """
+    Diffs an existing policy (or `None`) against the desired values.
+
+    Returns:
+        A changes dict suitable for salt state returns, empty if nothing differs
+    """
+
+    if existing is None:
+        return {
+            "name": {"old": "", "new": name},
+            "rules": {"old": "", "new": rules},
+            "description": {"old": "", "new": description},
+        }
+
+    changes = {}
+    if existing["Rules"] != rules:
+        changes["rules"] = {"old": existing["Rules"], "new": rules}
+    if existing["Name"] != name:
+        changes["name"] = {"old": existing["Name"], "new": name}
+    if existing["Description"] != description:
+        changes["description"] = {"old": existing["Description"], "new": description}
+    return changes
+
+
+def _policy_step(name, rules, description, consul_host, consul_token):
+    """
+    Builds the plan step that brings a policy in line with the desired values.
+
+    Returns:
+        A plan step dict, or `None` if the policy is already up to date
+    """
+
+    existing = policy_from_name(name, consul_host, consul_token)
+    changes = _policy_changes(existing, name, rules, description)
+    if not changes:
+        return None
+
+    step = {
+        "kind": "policy",
+        "name": name,
+        "changes": changes,
+        "method": "PUT",
+        "body": {"Name": name, "Description": description, "Rules": rules},
+    }
+    if existing is None:
+        step.update({"action": "create", "id": None, "endpoint": "acl/policy"})
+    else:
+        step.update(
+            {
+                "action": "update",
+                "id": existing["ID"],
+                "endpoint": f"acl/policy/{existing['ID']}",
+            }
+        )
+    return step
+
+
+def _policy_delete_step(name, consul_host, consul_token):
+    """
+    Builds the plan step that deletes a policy.
+
+    Returns:
+        A plan step dict, or `None` if no policy exists with that name
+    """
+
+    policy = policy_from_name(name, consul_host, consul_token)
+    if policy is None:
+        return None
+
+    return {
+        "kind": "policy",
+        "action": "delete",
+        "name": name,
+        "id": policy["ID"],
+        "method": "DELETE",
+        "endpoint": f"acl/policy/{policy['ID']}",
+        "changes": {
+            "id": {"old": policy["ID"], "new": ""},
+            "name": {"old": policy["Name"], "new": ""},
+            "description": {"old": policy["Description"], "new": ""},
+            "rules": {"old": policy["Rules"], "new": ""},
+        },
+    }
 
 
 def create_update_policy(name, rules, description, consul_host, consul_token):
@@ -164,42 +1163,12 @@ def create_update_policy(name, rules, description, consul_host, consul_token):
         for salt state returns.
     """
 
-    session = get_session(consul_host, consul_token)
-
-    existing = policy_from_name(name, consul_host, consul_token)
-
-    if existing:
-        # Update
-        if existing["Rules"] == rules and existing["Description"] == description:
-            return (False, {})  # No changes
-
-        resp = session.put(
-            f'acl/policy/{existing["ID"]}',
-            json={"Name": name, "Description": description, "Rules": rules},
-        )
-        resp.raise_for_status()
-
-        changes = {"rules": {"old": existing["Rules"], "new": rules}}
-        if name != existing["Name"]:
-            changes["name"] = {"old": existing["Name"], "new": name}
-        if description != existing["Description"]:
-            changes["description"] = {
-                "old": existing["Description"],
-                "new": description,
-            }
-        return (False, changes)
+    step = _policy_step(name, rules, description, consul_host, consul_token)
+    if step is None:
+        return (False, {})  # No changes
 
-    # Create
-    resp = session.put(
-        "acl/policy", json={"Name": name, "Description": description, "Rules": rules}
-    )
-    resp.raise_for_status()
-    changes = {
-        "name": {"old": "", "new": name},
-        "rules": {"old": "", "new": rules},
-        "description": {"old": "", "new": description},
-    }
-    return (True, changes)
+    _apply_step(get_session(consul_host, consul_token), step)
+    return (step["action"] == "create", step["changes"])
 
 
 def delete_policy(name, consul_host, consul_token):
@@ -213,18 +1182,12 @@ def delete_policy(name, consul_host, consul_token):
         A changes dict suitable for salt state returns
     """
 
-    policy = policy_from_name(name, consul_host, consul_token)
-    if policy is None:
+    step = _policy_delete_step(name, consul_host, consul_token)
+    if step is None:
         return {}
 
-    resp = get_session(consul_host, consul_token).delete(f"acl/policy/{policy['ID']}")
-    resp.raise_for_status()
-    return {
-        "id": {"old": policy["ID"], "new": ""},
-        "name": {"old": policy["Name"], "new": ""},
-        "description": {"old": policy["Description"], "new": ""},
-        "rules": {"old": policy["Rules"], "new": ""},
-    }
+    _apply_step(get_session(consul_host, consul_token), step)
+    return step["changes"]
 
 
 def token_accessor_from_name(name):
@@ -246,6 +1209,9 @@ def token_link_names(token):
     """
     Extracts the list of policy names and role names from the Consul token link objects.
 
+    The names are cached for the run by accessor and ``ModifyIndex``, so a
+    token is only walked once however many times it is diffed.
+
     Args:
         token: a dict representation of the json return of a consul token
 
@@ -254,6 +1220,11 @@ def token_link_names(token):
         of strings
     """
 
+    key = (token.get("AccessorID"), token.get("ModifyIndex"))
+    cache = _run_context().setdefault("consul.link_names", {})
+    if None not in key and key in cache:
+        return cache[key]
+
     policies = []
     roles = []
 
@@ -263,9 +1234,37 @@ def token_link_names(token):
     if "Roles" in token:
         roles = [role["Name"] for role in token["Roles"]]
 
+    if None not in key:
+        cache[key] = (policies, roles)
     return (policies, roles)
 
 
+def _token_known_absent(session, accessor):
+    with _POOL.absent_tokens_lock:
+        expires = _POOL.absent_tokens.get((session.base_url, accessor))
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del _POOL.absent_tokens[(session.base_url, accessor)]
+            return False
+        return True
+
+
+def _remember_absent_token(session, accessor):
+    ttl = __salt__["config.get"](
+        "consul:negative_cache_ttl", CONSUL_DEFAULT_NEGATIVE_CACHE_TTL
+    )
+    if ttl:
+        with _POOL.absent_tokens_lock:
+            expires = time.monotonic() + ttl
+            _POOL.absent_tokens[(session.base_url, accessor)] = expires
+
+
+def _forget_absent_token(session, accessor):
+    with _POOL.absent_tokens_lock:
+        _POOL.absent_tokens.pop((session.base_url, accessor), None)
+
+
 def token_by_name_or_accessor(consul_host, consul_token, name=None, accessor=None):
     """
     Convenience function to fetch a token object from Consul either from a salt-internal
@@ -274,6 +1273,12 @@ def token_by_name_or_accessor(consul_host, consul_token, name=None, accessor=Non
     Either ``name`` or ``accessor`` must be provided; if neither are, an exception is
     raised.
 
+    The token is read directly first. Consul answers 403 instead of 404 for an
+    unknown accessor, which can't be told apart from a permissions problem, so
+    only then is the token list consulted (once per run). Accessors found to be
+    absent are remembered for ``consul:negative_cache_ttl`` seconds, and tokens
+    created through this module are removed from that cache.
+
     Args:
         name: the salt name for this token
         accessor: the consul token accessor UUID
@@ -290,20 +1295,131 @@ def token_by_name_or_accessor(consul_host, consul_token, name=None, accessor=Non
 
     session = get_session(consul_host, consul_token)
 
-    # There doesn't seem to be any way to get this without two calls, since
-    # consul returns a 403 instead of 404 when requesting a nonexistant
-    # token accessor ID.
-    resp = session.get("acl/tokens")
-    resp.raise_for_status()
-    tokens = resp.json()
+    if _token_known_absent(session, accessor):
+        return None
+
+    if _loaded_acl_snapshot(session, "tokens") is None:
+        resp = session.get(f"acl/token/{accessor}")
+        if resp.ok:
+            return resp.json()
+        if resp.status_code == 404:
+            _remember_absent_token(session, accessor)
+            return None
+        if resp.status_code != 403:
+            resp.raise_for_status()
+
+    token = _acl_detail(session, "tokens", accessor)
+    if token is None:
+        _remember_absent_token(session, accessor)
+    return token
+
+
+def _token_changes(existing, accessor, secret, description, policies, roles):
+    """
+    Diffs an existing token (or `None`) against the desired values. Policy and
+    role links are compared as sets of names, and the secret is only shown as
+    `REDACTED`.
+
+    Raises:
+        CheckError: if the existing token has a different secret
+
+    Returns:
+        A changes dict suitable for salt state returns, empty if nothing differs
+    """
+
+    if existing is None:
+        return {
+            "accessor": {"old": "", "new": accessor},
+            "secret": {"old": "", "new": REDACTED},
+            "description": {"old": "", "new": description},
+            "policies": {"old": [], "new": policies},
+            "roles": {"old": [], "new": roles},
+        }
+
+    if existing["SecretID"] != secret:
+        raise exceptions.CheckError(
+            "attempting to change a secretID on an existing consul token"
+        )
+
+    existing_policy_names, existing_role_names = token_link_names(existing)
+
+    changes = {}
+    if existing["Description"] != description:
+        changes["description"] = {"old": existing["Description"], "new": description}
+    if set(existing_policy_names) != set(policies):
+        changes["policies"] = {"old": existing_policy_names, "new": policies}
+    if set(existing_role_names) != set(roles):
+        changes["roles"] = {"old": existing_role_names, "new": roles}
+    return changes
+
+
+def _token_step(name, secret, description, policies, roles, consul_host, consul_token):
+    """
+    Builds the plan step that brings a token in line with the desired values.
+
+    Returns:
+        A plan step dict, or `None` if the token is already up to date
+    """
 
-    found = [token for token in tokens if token["AccessorID"] == accessor]
-    if not found:
+    accessor = token_accessor_from_name(name)
+    existing = token_by_name_or_accessor(
+        accessor=accessor, consul_host=consul_host, consul_token=consul_token
+    )
+    changes = _token_changes(existing, accessor, secret, description, policies, roles)
+    if not changes:
         return None
 
-    resp = session.get(f"acl/token/{accessor}")
-    resp.raise_for_status()
-    return resp.json()
+    body = {"AccessorID": accessor, "Description": description}
+    if policies:
+        body["Policies"] = [{"Name": policy} for policy in policies]
+    if roles:
+        body["Roles"] = [{"Name": role} for role in roles]
+
+    step = {
+        "kind": "token",
+        "name": name,
+        "id": accessor,
+        "changes": changes,
+        "method": "PUT",
+        "body": body,
+    }
+    if existing is None:
+        body["SecretID"] = secret
+        step.update({"action": "create", "endpoint": "acl/token"})
+    else:
+        step.update({"action": "update", "endpoint": f"acl/token/{accessor}"})
+    return step
+
+
+def _token_delete_step(name, consul_host, consul_token):
+    """
+    Builds the plan step that deletes a token.
+
+    Returns:
+        A plan step dict, or `None` if no token exists with that name
+    """
+
+    token = token_by_name_or_accessor(
+        consul_host=consul_host, consul_token=consul_token, name=name
+    )
+    if token is None:
+        return None
+
+    policy_names, role_names = token_link_names(token)
+    return {
+        "kind": "token",
+        "action": "delete",
+        "name": name,
+        "id": token["AccessorID"],
+        "method": "DELETE",
+        "endpoint": f"acl/token/{token['AccessorID']}",
+        "changes": {
+            "accessor": {"old": token["AccessorID"], "new": ""},
+            "description": {"old": token["Description"], "new": ""},
+            "policies": {"old": policy_names, "new": []},
+            "roles": {"old": role_names, "new": []},
+        },
+    }
 
 
 def create_update_token(
@@ -329,49 +1445,981 @@ def create_update_token(
         for salt state returns
     """
 
-    accessor = token_accessor_from_name(name)
-    existing = token_by_name_or_accessor(
-        accessor=accessor, consul_host=consul_host, consul_token=consul_token
+    step = _token_step(
+        name, secret, description, policies, roles, consul_host, consul_token
     )
+    if step is None:
+        return (False, {})  # No changes
 
-    params = {"AccessorID": accessor, "Description": description}
-    if policies:
-        params["Policies"] = [{"Name": policy} for policy in policies]
-    if roles:
-        params["Roles"] = [{"Name": role} for role in roles]
+    _apply_step(get_session(consul_host, consul_token), step)
+    return (step["action"] == "create", step["changes"])
+
+
+def delete_token(name, consul_host, consul_token):
+    """
+    Ensures a token with the accessor derived from the given salt name does not
+    exist.
+
+    Args:
+        name: the salt name for this token
+
+    Returns:
+        A changes dict suitable for salt state returns
+    """
+
+    step = _token_delete_step(name, consul_host, consul_token)
+    if step is None:
+        return {}
+
+    _apply_step(get_session(consul_host, consul_token), step)
+    return step["changes"]
+
+
+# The order plan steps are applied in: policies must exist before the tokens
+# that link to them, and tokens go before the policies they might link to.
+_PLAN_ORDER = [
+    ("create", "policy"),
+    ("create", "token"),
+    ("update", "policy"),
+    ("update", "token"),
+    ("delete", "token"),
+    ("delete", "policy"),
+]
+
+_KIND_LABELS = {"policy": "Policy", "token": "Token"}
+
+
+def _created_object(session, step):
+    """
+    Reads back the object a create step would have made, in case an earlier
+    attempt reached Consul but its response was lost.
+
+    Returns:
+        The object, or `None` if it doesn't exist
+    """
+
+    if step["kind"] == "policy":
+        snapshot = _acl_snapshot(session, "policies", refresh=True)
+        policy_id = snapshot.by_name.get(step["name"])
+        if policy_id is None:
+            return None
+        return _acl_detail(session, "policies", policy_id)
+
+    _acl_snapshot(session, "tokens", refresh=True)
+    return _acl_detail(session, "tokens", step["id"])
+
+
+def _send_step(session, step):
+    """
+    Sends a plan step's request.
+
+    A create isn't safe to resend: if the first attempt reached Consul, a
+    second one fails on the duplicate name or AccessorID. So creates are sent
+    without the session's retries, and after a transient failure the object
+    is looked up by name or accessor before the create is tried again.
+
+    Returns:
+        The object Consul answered with, or `None` for a delete
+    """
+
+    if step["action"] != "create":
+        resp = session.request(step["method"], step["endpoint"], json=step.get("body"))
+        resp.raise_for_status()
+        return None if step["action"] == "delete" else resp.json()
+
+    retries = session.retry.retries
+    for attempt in range(retries + 1):
+        if attempt:
+            _record_retry(_endpoint_name(step["method"], step["endpoint"]))
+            time.sleep(session.retry.delay(attempt))
+            created = _created_object(session, step)
+            if created is not None:
+                return created
+        try:
+            resp = session.request(
+                step["method"], step["endpoint"], json=step.get("body"), retry=False
+            )
+        except _TRANSIENT_ERRORS:
+            if attempt == retries:
+                raise
+            continue
+        if resp.status_code not in RETRY_STATUSES or attempt == retries:
+            resp.raise_for_status()
+            return resp.json()
+
+
+def _apply_step(session, step):
+    """
+    Executes a single plan step and keeps the run's snapshots in line with it.
+    Snapshots that weren't loaded this run (e.g. when applying a plan made by
+    another process) are left unloaded rather than listed just to update them.
+    """
+
+    item = _send_step(session, step)
+
+    if step["kind"] == "policy":
+        snapshot = _loaded_acl_snapshot(session, "policies")
+        if snapshot is None:
+            return
+        if step["action"] == "delete":
+            snapshot.remove(step["id"])
+        else:
+            snapshot.put(item, detail=True)
+        return
+
+    snapshot = _loaded_acl_snapshot(session, "tokens")
+    if step["action"] == "delete":
+        _remember_absent_token(session, step["id"])
+        if snapshot is not None:
+            snapshot.remove(step["id"])
+    else:
+        _forget_absent_token(session, step["id"])
+        if snapshot is not None:
+            snapshot.put(item, detail=True)
+
+
+def _desired_list(desired):
+    """
+    Accepts either the pillar form of desired ACL objects (a dict keyed by
+    name) or a list of dicts with a ``name`` key, and returns the latter.
+    """
+
+    if isinstance(desired, dict):
+        return [dict(spec or {}, name=name) for name, spec in desired.items()]
+    return list(desired or [])
+
+
+def _plan(policies, tokens, consul_host, consul_token):
+    """
+    Computes one entry for every desired policy and token. Entries are either
+    a plan step, an ``"action": "none"`` entry for objects that are already up
+    to date, or an ``"action": "error"`` entry with a ``comment`` for objects
+    that could not be read or diffed.
+
+    All reads are spread over the thread pool; the policy list is loaded once
+    up front since every policy lookup needs it. If it can't be loaded, every
+    policy gets an error entry.
+    """
+
+    list_error = None
+    if policies:
+        try:
+            _acl_snapshot(get_session(consul_host, consul_token), "policies")
+        except Exception as e:
+            list_error = e
+
+    def policy_entry(policy):
+        try:
+            if list_error is not None:
+                raise list_error
+            if policy.get("absent"):
+                step = _policy_delete_step(policy["name"], consul_host, consul_token)
+            else:
+                step = _policy_step(
+                    policy["name"],
+                    policy.get("rules"),
+                    policy.get("description"),
+                    consul_host,
+                    consul_token,
+                )
+        except Exception as e:
+            verb = "deleting" if policy.get("absent") else "updating or creating"
+            return {
+                "kind": "policy",
+                "action": "error",
+                "name": policy["name"],
+                "comment": f"Error {verb} policy: {e.__repr__()}",
+            }
+        return step or {"kind": "policy", "action": "none", "name": policy["name"]}
+
+    def token_entry(token):
+        try:
+            if token.get("absent"):
+                step = _token_delete_step(token["name"], consul_host, consul_token)
+            else:
+                step = _token_step(
+                    token["name"],
+                    token.get("secret"),
+                    token.get("description"),
+                    token.get("policies", []),
+                    token.get("roles", []),
+                    consul_host,
+                    consul_token,
+                )
+        except Exception as e:
+            verb = "deleting" if token.get("absent") else "updating or creating"
+            return {
+                "kind": "token",
+                "action": "error",
+                "name": token["name"],
+                "comment": f"Error {verb} token: {e.__repr__()}",
+            }
+        return step or {"kind": "token", "action": "none", "name": token["name"]}
+
+    entries = _run_concurrently(policy_entry, _desired_list(policies))
+    entries += _run_concurrently(token_entry, _desired_list(tokens))
+    return entries
+
+
+def _entry_result(entry, test):
+    """
+    Turns a plan entry into a salt state return dict, as it would look before
+    (``test``) or after the entry is applied.
+    """
+
+    label = _KIND_LABELS[entry["kind"]]
+    name = entry["name"]
+    ret = {"name": name, "result": True, "changes": {}, "comment": ""}
+
+    if entry["action"] == "none":
+        ret["comment"] = f"{label} {name} is up to date"
+    elif entry["action"] == "error":
+        ret["result"] = False
+        ret["comment"] = entry["comment"]
+    elif test:
+        ret["result"] = None
+        ret["changes"] = entry["changes"]
+        ret["comment"] = f"{label} {name} would be {entry['action']}d"
+    else:
+        ret["changes"] = entry["changes"]
+        ret["comment"] = f"{label} {name} was {entry['action']}d"
+    return ret
+
+
+def _apply(entries, consul_host, consul_token):
+    """
+    Applies the steps among ``entries`` group by group in `_PLAN_ORDER`,
+    spreading each group over the thread pool.
+
+    Returns:
+        A list of salt state return dicts, in the same order as ``entries``
+    """
 
     session = get_session(consul_host, consul_token)
+    results = [None] * len(entries)
+
+    def apply(item):
+        position, entry = item
+        try:
+            _apply_step(session, entry)
+        except Exception as e:
+            verb = "deleting" if entry["action"] == "delete" else "updating or creating"
+            entry = dict(
+                entry,
+                action="error",
+                comment=f"Error {verb} {entry['kind']}: {e.__repr__()}",
+            )
+        results[position] = _entry_result(entry, test=False)
+
+    for action, kind in _PLAN_ORDER:
+        group = [
+            (position, entry)
+            for position, entry in enumerate(entries)
+            if entry["action"] == action and entry["kind"] == kind
+        ]
+        _run_concurrently(apply, group)
+
+    for position, entry in enumerate(entries):
+        if results[position] is None:
+            results[position] = _entry_result(entry, test=False)
+    return results
+
+
+def plan(policies=None, tokens=None, consul_host=None, consul_token=None):
+    """
+    Computes the ordered list of changes needed to bring Consul's ACL policies
+    and tokens in line with the desired ones, in a single pass of reads.
+
+    By default the desired objects come from the ``consul:policies`` and
+    ``consul:tokens`` pillar keys, which map names to the arguments of
+    `create_update_policy` and `create_update_token`. Entries with
+    ``absent: true`` are deleted instead.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call consul.plan
+
+    Returns:
+        A list of plan steps (creates, then updates, then deletes). Objects that
+        could not be read are included as ``"action": "error"`` entries. Token
+        secrets are replaced with `REDACTED`. The list can be passed to
+        `apply_plan`.
+    """
+
+    if policies is None:
+        policies = __salt__["pillar.get"]("consul:policies", {})
+    if tokens is None:
+        tokens = __salt__["pillar.get"]("consul:tokens", {})
+
+    entries = _plan(policies, tokens, consul_host, consul_token)
+    order = {key: position for position, key in enumerate(_PLAN_ORDER)}
+    steps = [_redacted(entry) for entry in entries if entry["action"] != "none"]
+    return sorted(
+        steps,
+        key=lambda step: order.get((step["action"], step["kind"]), len(order)),
+    )
+
+
+def _redacted(step):
+    body = step.get("body")
+    if body and "SecretID" in body:
+        return dict(step, body=dict(body, SecretID=REDACTED))
+    return step
+
+
+def _unredacted(step, secrets):
+    """
+    Puts a token's secret back into a create step that came from `plan`, or
+    turns the step into an error if there is no secret for it.
+    """
+
+    body = step.get("body")
+    if not body or body.get("SecretID") != REDACTED:
+        return step
+    secret = secrets.get(step["name"])
+    if not secret:
+        return dict(
+            step,
+            action="error",
+            comment=f"Error updating or creating token: no secret for {step['name']}",
+        )
+    return dict(step, body=dict(body, SecretID=secret))
+
+
+def apply_plan(steps, consul_host=None, consul_token=None, tokens=None):
+    """
+    Executes a plan computed by `plan` without reading anything from Consul
+    again. The only reads are to check whether a create whose response was
+    lost went through (see `_send_step`).
+
+    Args:
+        tokens: The desired tokens the plan was made from, defaulting to the
+            ``consul:tokens`` pillar, which the secrets of new tokens are
+            taken from
+
+    Returns:
+        A list of salt state return dicts, one per plan step
+    """
+
+    if tokens is None:
+        tokens = __salt__["pillar.get"]("consul:tokens", {})
+    secrets = {token["name"]: token.get("secret") for token in _desired_list(tokens)}
+    steps = [_unredacted(step, secrets) for step in steps]
+    return _apply(steps, consul_host, consul_token)
+
+
+def _reconcile(policies, tokens, consul_host, consul_token, test):
+    entries = _plan(policies, tokens, consul_host, consul_token)
+    if test:
+        return [_entry_result(entry, test=True) for entry in entries]
+    return _apply(entries, consul_host, consul_token)
+
+
+def reconcile_policies(desired, consul_host, consul_token, test=False):
+    """
+    Creates, updates or deletes many Consul ACL policies at once.
+
+    The policy list is read once, then the detail reads and writes for each
+    policy are spread over a thread pool (see ``consul:max_workers``). A
+    failure for one policy is reported in its own result and does not affect
+    the others.
+
+    Args:
+        desired: A list of dicts with the ``name``, ``rules`` and
+            ``description`` of each policy (or ``absent: true`` to delete it),
+            or a dict of the same keyed by name
+        test: Only report what would change
+
+    Returns:
+        A dict of policy name to a salt state return dict (``name``,
+        ``result``, ``changes`` and ``comment``)
+    """
+
+    results = _reconcile(desired, [], consul_host, consul_token, test)
+    return {ret["name"]: ret for ret in results}
+
+
+def reconcile_tokens(desired, consul_host, consul_token, test=False):
+    """
+    Creates, updates or deletes many Consul ACL tokens at once.
+
+    Each token is looked up with `token_by_name_or_accessor`, so the token
+    list is only read if some token cannot be read directly. The detail reads
+    and writes for each token are spread over a thread pool (see
+    ``consul:max_workers``). A failure for one token is reported in its own
+    result and does not affect the others.
+
+    Args:
+        desired: A list of dicts with the ``name``, ``secret``,
+            ``description``, ``policies`` and ``roles`` of each token (or
+            ``absent: true`` to delete it), or a dict of the same keyed by name
+        test: Only report what would change
+
+    Returns:
+        A dict of token name to a salt state return dict (``name``,
+        ``result``, ``changes`` and ``comment``)
+    """
+
+    results = _reconcile([], desired, consul_host, consul_token, test)
+    return {ret["name"]: ret for ret in results}
+
+
+AGENT_STATE_FILE = "consul_agent.json"
+
+# Agent writes are applied group by group in this order: services before the
+# checks that may point at them, and the other way round for deregistrations.
+_AGENT_PLAN_ORDER = [
+    ("register", "service"),
+    ("update", "service"),
+    ("register", "check"),
+    ("update", "check"),
+    ("deregister", "check"),
+    ("deregister", "service"),
+]
+
+_AGENT_LABELS = {"service": "Service", "check": "Check"}
+_AGENT_PAST_TENSE = {
+    "register": "registered",
+    "update": "updated",
+    "deregister": "deregistered",
+}
+
+# Fields of a service definition that `agent_services` reports back, with the
+# value the agent uses when the definition leaves them out.
+_SERVICE_FIELDS = {
+    "Service": ("name", ""),
+    "Tags": ("tags", []),
+    "Address": ("address", ""),
+    "Port": ("port", 0),
+    "Meta": ("meta", {}),
+}
+
+
+def agent_services(consul_host=None, consul_token=None):
+    """
+    Returns the services registered with the agent, keyed by ID.
+
+    See: https://www.consul.io/api/agent/service.html#list-services
+    """
+
+    resp = get_session(consul_host, consul_token).get("agent/services")
+    resp.raise_for_status()
+    return resp.json()
+
+
+def agent_checks(consul_host=None, consul_token=None):
+    """
+    Returns the checks registered with the agent, keyed by ID.
+
+    See: https://www.consul.io/api/agent/check.html#list-checks
+    """
+
+    resp = get_session(consul_host, consul_token).get("agent/checks")
+    resp.raise_for_status()
+    return resp.json()
+
 
-    if existing is not None:
-        if existing["SecretID"] != secret:
-            raise exceptions.CheckError(
-                "attempting to change a secretID on an existing consul token"
+def _definition_field(definition, key):
+    """
+    Looks up a definition field the way the agent does: case-insensitively,
+    and accepting snake_case.
+    """
+
+    for field, value in definition.items():
+        if field.lower().replace("_", "") == key:
+            return value
+    return None
+
+
+def _agent_definitions(desired):
+    """
+    Accepts either the pillar form of services or checks (a dict of
+    definitions keyed by name) or a list of definitions, and returns a dict of
+    the definitions keyed by the ID the agent will give them.
+    """
+
+    if isinstance(desired, dict):
+        named = []
+        for name, definition in desired.items():
+            definition = dict(definition or {})
+            if not _definition_field(definition, "name"):
+                definition["name"] = name
+            named.append(definition)
+        desired = named
+
+    definitions = {}
+    for definition in desired or []:
+        item_id = _definition_field(definition, "id") or _definition_field(
+            definition, "name"
+        )
+        if not item_id:
+            raise exceptions.SaltInvocationError(
+                f"Agent definition has no name or ID: {definition!r}"
+            )
+        definitions[item_id] = definition
+    return definitions
+
+
+def _service_name(item_id, definition):
+    if definition is None:
+        return None
+    return _definition_field(definition, "name") or item_id
+
+
+def agent_service_names(services=None, consul_host=None):
+    """
+    Returns the sorted names of the services an agent token needs write on:
+    the given ones, plus any registered by an earlier `reconcile_agent` call
+    that it still has to deregister.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call consul.agent_service_names
+
+    Args:
+        services: As for `reconcile_agent`, defaulting to the
+            ``consul:services`` pillar
+    """
+
+    if services is None:
+        services = __salt__["pillar.get"]("consul:services", {})
+    desired = _agent_definitions(services)
+    names = {_service_name(item_id, d) for item_id, d in desired.items()}
+
+    state = _read_agent_state().get(get_session(consul_host, None).base_url, {})
+    for item_id in state.get("service", {}):
+        if item_id not in desired:
+            names.add(state.get("names", {}).get(item_id, item_id))
+    return sorted(names)
+
+
+def _definition_hash(definition):
+    return hashlib.sha256(
+        json.dumps(definition, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def _service_drift(definition, current):
+    """
+    Diffs the fields of a service definition that the agent reports back
+    against its current registration.
+
+    Returns:
+        A changes dict suitable for salt state returns, empty if nothing differs
+    """
+
+    changes = {}
+    for field, (key, default) in _SERVICE_FIELDS.items():
+        old = current.get(field) or default
+        new = _definition_field(definition, key) or default
+        if old != new:
+            changes[key] = {"old": old, "new": new}
+    return changes
+
+
+def _agent_state_path():
+    return os.path.join(__opts__["cachedir"], AGENT_STATE_FILE)
+
+
+def _read_agent_state():
+    """
+    Returns the hashes of the definitions registered from here, keyed by the
+    agent's base URL, then by kind and ID, along with the ``names`` of the
+    services by ID.
+    """
+
+    try:
+        with open(_agent_state_path()) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_agent_state(base_url, registered):
+    state = _read_agent_state()
+    state[base_url] = registered
+    with open(_agent_state_path(), "w") as f:
+        json.dump(state, f)
+
+
+def _agent_plan(kind, desired, current, registered, prune):
+    """
+    Computes one entry per desired definition, plus a deregistration for each
+    ID this module registered earlier that is no longer desired if ``prune``
+    is set.
+
+    A definition is registered again when it is missing from the agent, when
+    it differs from the one last registered from here (compared by hash, since
+    the agent doesn't report every field back), or for services, when a
+    field the agent does report has drifted.
+    """
+
+    endpoint = f"agent/{kind}"
+    entries = []
+    for item_id, definition in desired.items():
+        entry = {"kind": kind, "name": item_id, "hash": _definition_hash(definition)}
+        if item_id not in current:
+            changes = {"id": {"old": "", "new": item_id}}
+            action = "register"
+        else:
+            changes = {}
+            if kind == "service":
+                changes = _service_drift(definition, current[item_id])
+            if registered.get(item_id) != entry["hash"]:
+                changes["definition"] = {
+                    "old": registered.get(item_id, ""),
+                    "new": entry["hash"],
+                }
+            action = "update" if changes else "none"
+
+        if action != "none":
+            entry.update(
+                {
+                    "endpoint": f"{endpoint}/register",
+                    "body": definition,
+                    "changes": changes,
+                }
+            )
+            if kind == "service":
+                # Drop embedded checks that are no longer in the definition
+                entry["params"] = {"replace-existing-checks": "true"}
+        entries.append(dict(entry, action=action))
+
+    if prune:
+        for item_id in sorted(set(registered) - set(desired)):
+            if item_id not in current:
+                continue
+            entries.append(
+                {
+                    "kind": kind,
+                    "action": "deregister",
+                    "name": item_id,
+                    "endpoint": f"{endpoint}/deregister/{quote(item_id, safe='')}",
+                    "changes": {"id": {"old": item_id, "new": ""}},
+                }
             )
+    return entries
 
-        endpoint = f"acl/token/{accessor}"
-        created = False
 
-        existing_policy_names, existing_role_names = token_link_names(existing)
+def _agent_entry_result(entry, test):
+    """
+    Turns an agent plan entry into a salt state return dict, as it would look
+    before (``test``) or after the entry is applied.
+    """
 
-        ret = {}
-        if existing["Description"] != description:
-            ret["description"] = {"old": existing["Description"], "new": description}
-        if sorted(existing_policy_names) != sorted(policies):
-            ret["policies"] = {"old": existing_policy_names, "new": policies}
-        if sorted(existing_role_names) != sorted(roles):
-            ret["roles"] = {"old": existing_role_names, "new": roles}
+    label = _AGENT_LABELS[entry["kind"]]
+    name = entry["name"]
+    ret = {"name": name, "result": True, "changes": {}, "comment": ""}
+
+    if entry["action"] == "none":
+        ret["comment"] = f"{label} {name} is up to date"
+    elif entry["action"] == "error":
+        ret["result"] = False
+        ret["comment"] = entry["comment"]
+    elif test:
+        ret["result"] = None
+        ret["changes"] = entry["changes"]
+        ret["comment"] = f"{label} {name} would be {_AGENT_PAST_TENSE[entry['action']]}"
     else:
-        endpoint = "acl/token"
-        created = True
-        params["SecretID"] = secret
-        ret = {
-            "accessor": {"old": "", "new": accessor},
-            "secret": {"old": "", "new": secret},
-            "description": {"old": "", "new": description},
-            "policies": {"old": [], "new": policies},
-            "roles": {"old": [], "new": roles},
+        ret["changes"] = entry["changes"]
+        ret["comment"] = f"{label} {name} was {_AGENT_PAST_TENSE[entry['action']]}"
+    return ret
+
+
+def reconcile_agent(
+    services=None,
+    checks=None,
+    consul_host=None,
+    consul_token=None,
+    prune=True,
+    test=False,
+):
+    """
+    Registers, updates and deregisters the agent's services and checks through
+    the agent API, without touching its config files or restarting it.
+
+    The agent's current services and checks are read once, diffed against the
+    desired definitions, and only the differences are written, spread over a
+    thread pool (see ``consul:max_workers``). The hash of every definition
+    registered from here is kept in ``consul_agent.json`` in the minion
+    cachedir, both to catch changes to fields the agent doesn't report back
+    and so that ``prune`` only ever deregisters what this module registered.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call consul.reconcile_agent test=true
+
+    Args:
+        services: A dict of service definitions keyed by name, or a list of
+            them, as for the agent API (``name``, ``id``, ``tags``, ``port``,
+            ``checks``, ...). Defaults to the ``consul:services`` pillar.
+        checks: The same for checks, defaulting to ``consul:checks``
+        prune: Deregister services and checks registered by an earlier call
+            that are no longer desired
+        test: Only report what would change
+
+    Returns:
+        A dict keyed by ``service/<id>`` and ``check/<id>`` of salt state
+        return dicts (``name``, ``result``, ``changes`` and ``comment``)
+
+    See: https://www.consul.io/api/agent/service.html#register-service
+    """
+
+    if services is None:
+        services = __salt__["pillar.get"]("consul:services", {})
+    if checks is None:
+        checks = __salt__["pillar.get"]("consul:checks", {})
+
+    session = get_session(consul_host, consul_token)
+    state = _read_agent_state().get(session.base_url, {})
+    registered = {kind: dict(state.get(kind, {})) for kind in _AGENT_LABELS}
+    current = {
+        "service": agent_services(consul_host, consul_token),
+        "check": agent_checks(consul_host, consul_token),
+    }
+
+    desired = {
+        "service": _agent_definitions(services),
+        "check": _agent_definitions(checks),
+    }
+    entries = []
+    for kind in ("service", "check"):
+        entries += _agent_plan(
+            kind, desired[kind], current[kind], registered[kind], prune
+        )
+
+    if test:
+        results = [_agent_entry_result(entry, test=True) for entry in entries]
+    else:
+        results = [None] * len(entries)
+
+        def apply(item):
+            position, entry = item
+            try:
+                resp = session.put(
+                    entry["endpoint"],
+                    json=entry.get("body"),
+                    params=entry.get("params"),
+                )
+                # Already gone, e.g. removed by hand
+                if not (entry["action"] == "deregister" and resp.status_code == 404):
+                    resp.raise_for_status()
+            except Exception as e:
+                entry = dict(
+                    entry,
+                    action="error",
+                    comment=f"Error trying to {entry['action']} {entry['kind']}: "
+                    f"{e.__repr__()}",
+                )
+            results[position] = _agent_entry_result(entry, test=False)
+            return entry
+
+        for action, kind in _AGENT_PLAN_ORDER:
+            group = [
+                (position, entry)
+                for position, entry in enumerate(entries)
+                if entry["action"] == action and entry["kind"] == kind
+            ]
+            for entry in _run_concurrently(apply, group):
+                if entry["action"] == "deregister":
+                    registered[kind].pop(entry["name"], None)
+                elif entry["action"] != "error":
+                    registered[kind][entry["name"]] = entry["hash"]
+
+        for position, entry in enumerate(entries):
+            if results[position] is None:
+                results[position] = _agent_entry_result(entry, test=False)
+        # Service names, so that `agent_service_names` can still grant write
+        # on a service until it has been deregistered
+        names = state.get("names", {})
+        registered["names"] = {
+            item_id: _service_name(item_id, desired["service"].get(item_id))
+            or names.get(item_id, item_id)
+            for item_id in registered["service"]
         }
+        _write_agent_state(session.base_url, registered)
 
-    resp = session.put(endpoint, json=params)
-    resp.raise_for_status()
-    return (created, ret)
+    return {
+        f"{entry['kind']}/{entry['name']}": ret
+        for entry, ret in zip(entries, results)
+    }
+
+
+_DURATION_UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600}
+_DURATION = re.compile(r"([0-9.]+)(ns|us|ms|s|m|h)")
+
+
+def _duration_seconds(duration):
+    """
+    Converts a Consul/Go duration string such as "5m" or "1m30s" to seconds.
+    Plain numbers are taken as seconds.
+    """
+
+    if isinstance(duration, (int, float)):
+        return duration
+
+    parts = _DURATION.findall(duration)
+    if not parts or "".join(n + u for n, u in parts) != duration:
+        raise exceptions.SaltInvocationError(f"Invalid duration {duration!r}")
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+
+def watch_acl(
+    consul_host=None, consul_token=None, index=None, wait=CONSUL_DEFAULT_WATCH_WAIT
+):
+    """
+    Waits for the ACL policy or token list to change, using Consul blocking
+    queries on ``acl/policies`` and ``acl/tokens``.
+
+    Without ``index`` the current indexes are returned straight away. With
+    one, both lists are queried with ``?index=`` and this returns as soon as
+    either of them moves, or after ``wait`` if neither does.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call consul.watch_acl index='{"policies": "10", "tokens": "12"}'
+
+    Args:
+        index: A dict of ``X-Consul-Index`` values keyed by "policies" and
+            "tokens", as returned by a previous call
+        wait: Maximum time to block, as a Consul duration string
+
+    Returns:
+        A dict of the latest known ``X-Consul-Index`` for "policies" and
+        "tokens"
+
+    See: https://www.consul.io/api/features/blocking.html
+    """
+
+    session = get_session(consul_host, consul_token)
+    index = dict(index or {})
+
+    # Consul adds up to wait/16 of jitter to a blocking query, so the read
+    # timeout has to cover that on top of the usual one.
+    connect_timeout, read_timeout = session.timeout
+    blocking_timeout = (connect_timeout, _duration_seconds(wait) * 17 / 16)
+    if read_timeout is not None:
+        blocking_timeout = (connect_timeout, blocking_timeout[1] + read_timeout)
+
+    def query(kind):
+        params = {}
+        timeout = None
+        if index.get(kind):
+            params = {"index": index[kind], "wait": wait}
+            timeout = blocking_timeout
+        resp = session.get(_ACL_LIST_ENDPOINTS[kind], params=params, timeout=timeout)
+        resp.raise_for_status()
+        return (kind, resp.headers.get("X-Consul-Index"))
+
+    # Not using _run_concurrently: the query that doesn't return first is left
+    # to finish in the background instead of holding up the caller.
+    pool = ThreadPoolExecutor(max_workers=len(_ACL_LIST_ENDPOINTS))
+    futures = [
+        pool.submit(contextvars.copy_context().run, query, kind)
+        for kind in _ACL_LIST_ENDPOINTS
+    ]
+    try:
+        if all(index.get(kind) for kind in _ACL_LIST_ENDPOINTS):
+            done, _ = wait_futures(futures, return_when=FIRST_COMPLETED)
+        else:
+            done = futures
+        for future in done:
+            kind, new_index = future.result()
+            index[kind] = new_index
+    finally:
+        pool.shutdown(wait=False)
+
+    return index
+
+
+def stats(reset=False, scope="run"):
+    """
+    Returns request statistics for the calls this module made to Consul:
+    per-endpoint request counts, status codes, errors, retries, bytes
+    transferred and latency histograms, plus totals.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call consul.stats scope=process
+
+    Args:
+        reset: Clear the counters after reading them
+        scope: ``run`` for the current run (e.g. a state run), or ``process``
+            for everything since this minion process started
+
+    Returns:
+        A dict as described in `RequestStats.report`
+    """
+
+    if scope not in ("run", "process"):
+        raise exceptions.SaltInvocationError("scope must be run or process")
+
+    request_stats = _run_stats() if scope == "run" else _POOL.stats
+    report = request_stats.report()
+    if reset:
+        with request_stats.lock:
+            request_stats.endpoints = {}
+    return report
+
+
+def stats_summary(report=None, since=None):
+    """
+    Formats a `stats` report as a single line, naming the busiest endpoint.
+
+    Args:
+        report: A `stats` report, by default the current run's
+        since: An earlier report of the same scope; only the requests made
+            after it are summarised
+    """
+
+    if report is None:
+        report = stats()
+    since = since or {"endpoints": {}}
+
+    def delta(current, previous, key):
+        return current[key] - previous.get(key, 0)
+
+    endpoints = {
+        endpoint: delta(counters, since["endpoints"].get(endpoint, {}), "requests")
+        for endpoint, counters in report["endpoints"].items()
+    }
+    retries = delta(report, since, "retries")
+    errors = delta(report, since, "errors")
+
+    summary = (
+        f"consul: {delta(report, since, 'requests')} requests in "
+        f"{delta(report, since, 'seconds'):.3f}s, "
+        f"{delta(report, since, 'bytes_received')} bytes received"
+    )
+    if retries or errors:
+        summary += f", {retries} retries, {errors} errors"
+    if any(endpoints.values()):
+        endpoint = max(endpoints, key=endpoints.get)
+        summary += f" (most: {endpoint} x{endpoints[endpoint]})"
+    return summary
+
+
+def fire_stats(tag="consul/stats", reset=True):
+    """
+    Sends this run's `stats` to the master as an event, e.g. as the last state
+    of a run, and resets them.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call consul.fire_stats
+    """
+
+    report = stats(reset=reset)
+    return __salt__["event.send"](tag, report)
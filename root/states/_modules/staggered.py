@@ -0,0 +1,171 @@
+"""
+Exec module for running highstates in a fixed, per-minion slot
+
+Instead of every minion running ``state.highstate`` on the same schedule
+(and hitting the master at once), each minion gets a fixed offset within the
+interval from a hash of its ID. The schedule calls `highstate` every minute;
+it only does anything once per interval, just after the minion's slot.
+
+When it is due, the master is asked for its release ``REVISION`` and load
+with the ``staggered.status`` runner (allowed through ``peer_run``):
+
+- If the master's load per CPU is above ``max_load``, the run is put off until
+  the next tick, up to ``max_deferrals`` ticks in a row so that a master that
+  stays busy doesn't stop highstates altogether.
+- If the revision hasn't changed since the last successful highstate, the
+  run is skipped, up to ``max_skips`` times in a row so that drift is still
+  corrected.
+
+If the master can't be asked, the highstate runs as normal.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = "staggered_highstate.json"
+DEFAULT_INTERVAL = 300
+DEFAULT_MAX_SKIPS = 11
+DEFAULT_MAX_DEFERRALS = 10
+
+
+def slot(interval=DEFAULT_INTERVAL):
+    """
+    Returns this minion's offset in seconds within ``interval``.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' staggered.slot
+    """
+
+    digest = hashlib.sha256(__opts__["id"].encode()).digest()
+    return int.from_bytes(digest[:8], "big") % int(interval)
+
+
+def _state_path():
+    return os.path.join(__opts__["cachedir"], STATE_FILE)
+
+
+def _read_state():
+    try:
+        with open(_state_path()) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_state(state):
+    with open(_state_path(), "w") as f:
+        json.dump(state, f)
+
+
+def _master_status():
+    """
+    Returns the ``staggered.status`` runner's result, or None if the master
+    could not be asked.
+    """
+
+    try:
+        status = __salt__["publish.runner"]("staggered.status")
+    except Exception as e:
+        log.debug("Could not get master status: %s", e)
+        return None
+    if not isinstance(status, dict):
+        log.debug("Could not get master status: %s", status)
+        return None
+    return status
+
+
+def _succeeded(ret):
+    if not isinstance(ret, dict):
+        return False
+    return all(
+        isinstance(state, dict) and state.get("result") is not False
+        for state in ret.values()
+    )
+
+
+def highstate(
+    interval=DEFAULT_INTERVAL,
+    max_skips=DEFAULT_MAX_SKIPS,
+    max_load=None,
+    max_deferrals=DEFAULT_MAX_DEFERRALS,
+    **kwargs,
+):
+    """
+    Runs ``state.highstate`` if this minion's slot has come up since it last
+    ran, unless the master is busy or nothing has been released since.
+
+    The first call only records the current interval, so that minions started
+    together don't all run at once.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' staggered.highstate max_load=1.5
+
+    Args:
+        interval: Seconds between highstates
+        max_skips: Most runs in a row to skip because REVISION is unchanged;
+            0 never skips
+        max_load: Put the run off while the master's 1 minute load average per
+            CPU is above this
+        max_deferrals: Most ticks in a row to put the run off because of
+            ``max_load``; 0 never puts it off
+        kwargs: Passed on to ``state.highstate``
+
+    Returns:
+        The highstate return if it ran, otherwise a dict with the reason
+    """
+
+    now = time.time()
+    period = int((now - slot(interval)) // int(interval))
+    state = _read_state()
+
+    if "period" not in state:
+        _write_state(dict(state, period=period))
+        return {"ran": False, "reason": "first run, waiting for slot"}
+    if period <= state["period"]:
+        return {"ran": False, "reason": "not due"}
+
+    status = _master_status()
+    if status is not None:
+        load = status.get("load")
+        deferrals = state.get("deferrals", 0)
+        if max_load is not None and load is not None and load > float(max_load):
+            if deferrals < int(max_deferrals):
+                log.info(
+                    "Master load %.2f above %s, putting highstate off", load, max_load
+                )
+                _write_state(dict(state, deferrals=deferrals + 1))
+                return {"ran": False, "reason": f"master load {load:.2f}"}
+            log.info(
+                "Master load %.2f above %s, running after %s deferrals",
+                load,
+                max_load,
+                deferrals,
+            )
+
+        revision = status.get("revision")
+        skips = state.get("skips", 0)
+        if revision and revision == state.get("revision") and skips < int(max_skips):
+            _write_state(dict(state, period=period, skips=skips + 1, deferrals=0))
+            return {"ran": False, "reason": f"revision {revision} unchanged"}
+    else:
+        revision = None
+
+    _write_state(dict(state, period=period, deferrals=0))
+    ret = __salt__["state.highstate"](**kwargs)
+    if _succeeded(ret):
+        _write_state(
+            dict(state, period=period, revision=revision, skips=0, deferrals=0)
+        )
+    return ret
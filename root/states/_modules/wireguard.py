@@ -0,0 +1,336 @@
+"""
+Exec module for reading and changing WireGuard interfaces in place
+
+Peers are diffed against ``wg show <interface> dump`` and only the additions,
+removals and updates are applied with ``wg set``, like ``wg syncconf`` does,
+so existing tunnels are left alone. Keys are passed to ``wg`` on stdin and
+are never included in return values.
+
+The endpoint last set for each peer is kept in ``wireguard_endpoints.json`` in
+the minion cachedir, so that a changed endpoint is applied while one the peer
+roamed away from is left alone.
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import socket
+
+from salt import exceptions
+
+log = logging.getLogger(__name__)
+
+ENDPOINTS_FILE = "wireguard_endpoints.json"
+PEER_FIELDS = (
+    "public_key",
+    "preshared_key",
+    "endpoint",
+    "allowed_ips",
+    "latest_handshake",
+    "transfer_rx",
+    "transfer_tx",
+    "persistent_keepalive",
+)
+
+
+def _wg(*args, stdin=None):
+    ret = __salt__["cmd.run_all"](
+        ["wg"] + list(args), stdin=stdin, python_shell=False, output_loglevel="quiet"
+    )
+    if ret["retcode"]:
+        raise exceptions.CommandExecutionError(
+            f"wg {' '.join(args[:2])} failed: {ret['stderr']}"
+        )
+    return ret["stdout"]
+
+
+def _none(value):
+    return None if value in ("(none)", "off") else value
+
+
+def _networks(allowed_ips):
+    """
+    Normalises allowed IPs, given as a list or comma separated string, to a
+    sorted list of networks the way ``wg`` reports them.
+    """
+
+    if isinstance(allowed_ips, str):
+        allowed_ips = allowed_ips.split(",")
+    return sorted(
+        str(ipaddress.ip_network(ip.strip(), strict=False))
+        for ip in allowed_ips or []
+        if ip.strip()
+    )
+
+
+def _parse_dump(dump):
+    lines = dump.splitlines()
+    if not lines:
+        raise exceptions.CommandExecutionError("wg show dump returned nothing")
+
+    _, public_key, listen_port, fwmark = lines[0].split("\t")
+    peers = {}
+    for line in lines[1:]:
+        peer = dict(zip(PEER_FIELDS, line.split("\t")))
+        peers[peer["public_key"]] = {
+            "preshared_key": _none(peer["preshared_key"]),
+            "endpoint": _none(peer["endpoint"]),
+            "allowed_ips": _networks(_none(peer["allowed_ips"])),
+            "latest_handshake": int(peer["latest_handshake"]),
+            "transfer_rx": int(peer["transfer_rx"]),
+            "transfer_tx": int(peer["transfer_tx"]),
+            "persistent_keepalive": int(_none(peer["persistent_keepalive"]) or 0),
+        }
+    return {
+        "public_key": public_key,
+        "listen_port": int(listen_port),
+        "fwmark": _none(fwmark),
+        "peers": peers,
+    }
+
+
+def _show(interface):
+    return _parse_dump(_wg("show", interface, "dump"))
+
+
+def show(interface):
+    """
+    Returns an interface's public key, listen port, fwmark and peers, parsed
+    from ``wg show <interface> dump``. Preshared keys are left out.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' wireguard.show wg0
+
+    Returns:
+        A dict with ``public_key``, ``listen_port``, ``fwmark`` and ``peers``,
+        a dict keyed by public key of each peer's ``endpoint``,
+        ``allowed_ips``, ``latest_handshake``, ``transfer_rx``,
+        ``transfer_tx`` and ``persistent_keepalive``
+    """
+
+    current = _show(interface)
+    for peer in current["peers"].values():
+        peer.pop("preshared_key")
+    return current
+
+
+def is_up(interface):
+    """
+    Returns whether the WireGuard interface exists.
+    """
+
+    ret = __salt__["cmd.run_all"](
+        ["wg", "show", interface, "public-key"],
+        python_shell=False,
+        output_loglevel="quiet",
+    )
+    return ret["retcode"] == 0
+
+
+def addresses(interface):
+    """
+    Returns the sorted addresses (with prefix length) assigned to an
+    interface.
+    """
+
+    out = __salt__["cmd.run"](
+        ["ip", "-o", "addr", "show", "dev", interface], python_shell=False
+    )
+    found = []
+    for line in out.splitlines():
+        fields = line.split()
+        if len(fields) > 3 and fields[2] in ("inet", "inet6"):
+            found.append(str(ipaddress.ip_interface(fields[3])))
+    return sorted(found)
+
+
+def pubkey(private_key):
+    """
+    Returns the public key for a private key.
+    """
+
+    return _wg("pubkey", stdin=private_key.strip() + "\n").strip()
+
+
+def set_private_key(interface, private_key):
+    """
+    Changes an interface's private key in place.
+    """
+
+    _wg("set", interface, "private-key", "/dev/stdin", stdin=private_key.strip())
+    return True
+
+
+def _desired_peer(peer):
+    return {
+        "public_key": peer["public_key"],
+        "preshared_key": (peer.get("preshared_key") or "").strip() or None,
+        "endpoint": peer.get("endpoint") or None,
+        "allowed_ips": _networks(peer.get("allowed_ips")),
+        "persistent_keepalive": int(peer.get("persistent_keepalive") or 0),
+    }
+
+
+def _endpoints_path():
+    return os.path.join(__opts__["cachedir"], ENDPOINTS_FILE)
+
+
+def _read_endpoints():
+    """
+    Returns the endpoints last set from here, keyed by interface, then by
+    peer public key.
+    """
+
+    try:
+        with open(_endpoints_path()) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_endpoints(endpoints):
+    with open(_endpoints_path(), "w") as f:
+        json.dump(endpoints, f)
+
+
+def _resolve_endpoint(endpoint):
+    """
+    Returns the ``host:port`` endpoint as ``wg`` reports it once resolved:
+    each address ``host`` resolves to, with the port (IPv6 in brackets).
+    """
+
+    host, _, port = endpoint.rpartition(":")
+    host = host.strip("[]")
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+    except (socket.gaierror, UnicodeError) as e:
+        log.debug("Could not resolve WireGuard endpoint %s: %s", endpoint, e)
+        return set()
+    return {
+        f"[{info[4][0]}]:{port}" if info[0] == socket.AF_INET6 else f"{info[4][0]}:{port}"
+        for info in infos
+    }
+
+
+def _endpoint_changed(current, desired, applied):
+    """
+    Returns whether a peer's endpoint needs setting. Peers roam, so the live
+    endpoint is only compared when there's no record of the one last set
+    from here (``applied``), and then after resolving the desired one, since
+    ``wg`` reports a hostname endpoint as the address it resolved to.
+    """
+
+    if not desired:
+        return False
+    if not current:
+        return True
+    if applied is not None:
+        return applied != desired
+    return current not in _resolve_endpoint(desired) and current != desired
+
+
+def _peer_changes(current, desired, applied=None):
+    """
+    Diffs a peer's current settings (or `None`) against the desired ones.
+
+    See `_endpoint_changed` for how endpoints are compared, with ``applied``
+    the endpoint last set from here. Preshared keys are reported as changed
+    without their values.
+    """
+
+    if current is None:
+        changes = {"public_key": {"old": "", "new": desired["public_key"]}}
+        current = {"endpoint": None, "allowed_ips": [], "persistent_keepalive": 0}
+    else:
+        changes = {}
+        if current["preshared_key"] != desired["preshared_key"]:
+            changes["preshared_key"] = {"old": "<hidden>", "new": "<hidden>"}
+
+    if _endpoint_changed(current["endpoint"], desired["endpoint"], applied):
+        changes["endpoint"] = {
+            "old": current["endpoint"] or "",
+            "new": desired["endpoint"],
+        }
+
+    for key in ("allowed_ips", "persistent_keepalive"):
+        if current[key] != desired[key]:
+            changes[key] = {"old": current[key], "new": desired[key]}
+    return changes
+
+
+def _set_peer(interface, peer, changes):
+    args = ["set", interface, "peer", peer["public_key"]]
+    stdin = None
+    new_peer = "public_key" in changes
+    if "preshared_key" in changes or (new_peer and peer["preshared_key"]):
+        # An empty file clears the preshared key
+        args += ["preshared-key", "/dev/stdin"]
+        stdin = peer["preshared_key"] or ""
+    if "endpoint" in changes:
+        args += ["endpoint", peer["endpoint"]]
+    if "persistent_keepalive" in changes:
+        args += ["persistent-keepalive", str(peer["persistent_keepalive"] or "off")]
+    args += ["allowed-ips", ",".join(peer["allowed_ips"])]
+    _wg(*args, stdin=stdin)
+
+
+def sync_peers(interface, peers, test=False):
+    """
+    Brings an interface's peers in line with ``peers`` in place: new peers are
+    added, peers that aren't listed are removed, and changed peers are
+    updated, without touching the others.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' wireguard.sync_peers wg0 \
+            '[{"public_key": "...", "allowed_ips": "10.1.0.2/32"}]' test=true
+
+    Args:
+        peers: A list of dicts with each peer's ``public_key`` and optionally
+            ``preshared_key``, ``endpoint``, ``allowed_ips`` (a list or comma
+            separated string) and ``persistent_keepalive``
+        test: Only report what would change
+
+    Returns:
+        A changes dict keyed by peer public key, empty if nothing differs
+    """
+
+    current = _show(interface)["peers"]
+    desired = {peer["public_key"]: _desired_peer(peer) for peer in peers or []}
+    endpoints = _read_endpoints()
+    applied = endpoints.get(interface, {})
+
+    changes = {}
+    for public_key, peer in desired.items():
+        peer_changes = _peer_changes(
+            current.get(public_key), peer, applied.get(public_key)
+        )
+        if not peer_changes:
+            continue
+        if not test:
+            _set_peer(interface, peer, peer_changes)
+        changes[public_key] = peer_changes
+
+    for public_key in sorted(set(current) - set(desired)):
+        if not test:
+            _wg("set", interface, "peer", public_key, "remove")
+        changes[public_key] = {"public_key": {"old": public_key, "new": ""}}
+
+    if not test:
+        # Every desired endpoint is now either set or matched the live one
+        recorded = {
+            public_key: peer["endpoint"]
+            for public_key, peer in desired.items()
+            if peer["endpoint"]
+        }
+        if recorded != applied:
+            endpoints[interface] = recorded
+            _write_endpoints(endpoints)
+
+    return changes
@@ -0,0 +1,250 @@
+"""
+Decrypt GPG pillar values, caching the plaintext in memory
+
+A drop-in replacement for the builtin ``gpg`` ext_pillar. Every PGP message in
+the pillar is looked up by the SHA256 of its ciphertext, and only the misses
+are decrypted, all in a single ``gpg --decrypt-files`` run rather than one gpg
+process per value.
+
+Plaintext is only ever held in memory, in an LRU of up to ``size`` values that
+expire after ``ttl`` seconds. The cache is dropped whenever the release
+``REVISION`` changes; if ``warm`` is set to the pillar root, every PGP message
+in the new release's YAML files is then decrypted straight away in one batch.
+
+.. code-block:: yaml
+
+    ext_pillar:
+      - stack_cache:
+          root: /srv/salt/current/pillar
+      - gpg_cache:
+          revision_file: /srv/salt/current/REVISION
+          warm: /srv/salt/current/pillar
+
+Set ``gpg_keydir`` in the master config to change the gpg homedir, as with the
+builtin renderer.
+"""
+
+import collections
+import glob
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import salt.utils.path
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 1024
+DEFAULT_TTL = 86400
+
+GPG_CIPHERTEXT = re.compile(
+    r"-----BEGIN PGP MESSAGE-----.*?-----END PGP MESSAGE-----", re.DOTALL
+)
+# A PGP message in a YAML block scalar, with the indentation of its first line
+YAML_CIPHERTEXT = re.compile(
+    r"^([ \t]*)(-----BEGIN PGP MESSAGE-----$.*?^\1-----END PGP MESSAGE-----)$",
+    re.DOTALL | re.MULTILINE,
+)
+
+# The master builds a new loader, and so a new module object, for every
+# pillar compile. The cache lives in a holder module registered in
+# sys.modules instead, which every copy of this module in the process shares.
+_STATE_MODULE = "salt_ext_pillar_gpg_cache_state"
+_STATE = types.ModuleType(_STATE_MODULE)
+_STATE.cache = collections.OrderedDict()
+_STATE.lock = threading.Lock()
+_STATE.revision = None
+_STATE = sys.modules.setdefault(_STATE_MODULE, _STATE)
+
+
+def _key(ciphertext):
+    return hashlib.sha256(ciphertext.encode()).hexdigest()
+
+
+def _get(ciphertext):
+    key = _key(ciphertext)
+    with _STATE.lock:
+        entry = _STATE.cache.get(key)
+        if entry is None:
+            return None
+        expires, plaintext = entry
+        if time.monotonic() >= expires:
+            del _STATE.cache[key]
+            return None
+        _STATE.cache.move_to_end(key)
+        return plaintext
+
+
+def _put(ciphertext, plaintext, size, ttl):
+    with _STATE.lock:
+        _STATE.cache[_key(ciphertext)] = (time.monotonic() + ttl, plaintext)
+        _STATE.cache.move_to_end(_key(ciphertext))
+        while len(_STATE.cache) > size:
+            _STATE.cache.popitem(last=False)
+
+
+def _key_dir():
+    return __opts__.get(
+        "gpg_keydir",
+        os.path.join(
+            __opts__.get("config_dir", os.path.dirname(__opts__["conf_file"])),
+            "gpgkeys",
+        ),
+    )
+
+
+def _decrypt(ciphertexts):
+    """
+    Decrypts every ciphertext with a single gpg run.
+
+    Returns:
+        A dict of ciphertext to plaintext, leaving out any that failed
+    """
+
+    gpg = salt.utils.path.which("gpg")
+    if not gpg:
+        log.error("gpg is not installed, cannot decrypt pillar")
+        return {}
+
+    # Decrypted files only exist for the length of this call; keep them off
+    # disk when there's a tmpfs for it.
+    tmp_root = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=tmp_root, prefix="gpg-pillar") as tmp:
+        paths = []
+        for i, ciphertext in enumerate(ciphertexts):
+            path = os.path.join(tmp, f"{i}.asc")
+            with open(path, "w") as f:
+                f.write(ciphertext)
+            paths.append(path)
+
+        cmd = [gpg, "--homedir", _key_dir(), "--batch", "--yes", "--quiet"]
+        proc = subprocess.run(
+            cmd + ["--decrypt-files"] + paths,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if proc.returncode:
+            log.error("Could not decrypt all pillar values: %s", proc.stderr.decode())
+
+        plaintexts = {}
+        for ciphertext, path in zip(ciphertexts, paths):
+            try:
+                with open(path[: -len(".asc")]) as f:
+                    plaintexts[ciphertext] = f.read()
+            except (IOError, OSError):
+                log.error("Could not decrypt pillar value %s", _key(ciphertext))
+        return plaintexts
+
+
+def _collect(data, found):
+    if isinstance(data, dict):
+        for value in data.values():
+            _collect(value, found)
+    elif isinstance(data, list):
+        for value in data:
+            _collect(value, found)
+    elif isinstance(data, str):
+        found.update(GPG_CIPHERTEXT.findall(data))
+    return found
+
+
+def _replace(data, plaintexts):
+    if isinstance(data, dict):
+        return {key: _replace(value, plaintexts) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_replace(value, plaintexts) for value in data]
+    if isinstance(data, str):
+        return GPG_CIPHERTEXT.sub(
+            lambda match: plaintexts.get(match.group(0), match.group(0)), data
+        )
+    return data
+
+
+def _release_ciphertexts(root):
+    """
+    Finds every PGP message in the YAML files under ``root``.
+    """
+
+    found = set()
+    for path in glob.glob(os.path.join(root, "**", "*.yml"), recursive=True):
+        with open(path) as f:
+            text = f.read()
+        for indent, block in YAML_CIPHERTEXT.findall(text):
+            lines = [
+                line.replace(indent, "", 1) if line.startswith(indent) else line
+                for line in block.split("\n")
+            ]
+            found.add("\n".join(lines))
+    return found
+
+
+def _check_revision(revision_file, warm, size, ttl):
+    """
+    Drops the cache if the release has changed, then warms it if asked to.
+    """
+
+    revision = None
+    if revision_file:
+        try:
+            with open(revision_file) as f:
+                revision = f.read().strip()
+        except (IOError, OSError):
+            pass
+
+    with _STATE.lock:
+        if revision == _STATE.revision:
+            return
+        _STATE.revision = revision
+        _STATE.cache.clear()
+
+    if warm:
+        ciphertexts = sorted(_release_ciphertexts(warm))
+        log.debug("Decrypting %s pillar values for %s", len(ciphertexts), revision)
+        for ciphertext, plaintext in _decrypt(ciphertexts).items():
+            _put(ciphertext, plaintext, size, ttl)
+
+
+def ext_pillar(
+    minion_id,
+    pillar,
+    size=DEFAULT_SIZE,
+    ttl=DEFAULT_TTL,
+    revision_file=None,
+    warm=None,
+):
+    """
+    Returns ``pillar`` with every PGP message replaced by its plaintext.
+
+    Args:
+        size: Maximum number of plaintext values to keep
+        ttl: Seconds to keep each plaintext value for
+        revision_file: The release's REVISION file; the cache is dropped when
+            its content changes
+        warm: A pillar root to decrypt all PGP messages from when the
+            revision changes
+    """
+
+    _check_revision(revision_file, warm, size, ttl)
+
+    plaintexts = {}
+    misses = []
+    for ciphertext in _collect(pillar, set()):
+        plaintext = _get(ciphertext)
+        if plaintext is None:
+            misses.append(ciphertext)
+        else:
+            plaintexts[ciphertext] = plaintext
+
+    if misses:
+        for ciphertext, plaintext in _decrypt(misses).items():
+            _put(ciphertext, plaintext, size, ttl)
+            plaintexts[ciphertext] = plaintext
+
+    return _replace(pillar, plaintexts)
@@ -0,0 +1,258 @@
+"""
+Layered pillar with the shared layers memoized per role set and release
+
+Builds the same kind of stacked pillar as ``pillar/stack.cfg`` did, from:
+
+1. ``common/*.yml``
+2. ``roles/<role>.yml`` for each role in the ``roles`` grain, in sorted order
+3. ``minion/*.yml``
+4. ``nodes/<minion_id>.yml``
+
+Layers 1 and 2 only depend on the role set and the release, so they are
+rendered and merged once per distinct (release, sorted roles) and kept in an
+LRU cache: in memory, and on disk under the master cachedir so that every
+master worker shares it and it outlasts master restarts. Only layers 3 and 4
+are rendered per minion; put anything that depends on the minion's grains or
+id there.
+
+Shared layers are rendered with undefined variables as errors, and without
+``__salt__``, ``__grains__`` or the master's own grains in ``__opts__``:
+execution functions such as ``grains.get`` run on the master there and would
+return the master's values, which would then be cached for every minion.
+Shared layers only get ``__opts__``, ``roles`` and ``revision``.
+
+The release is identified by the ``REVISION`` file written by deploys, next to
+the pillar root, along with the resolved pillar root path. Its ``REVISION`` is
+also set as ``salt:revision`` in every minion's pillar. Without a readable
+``REVISION`` the release is identified by the paths, sizes and modification
+times of every file under the pillar root instead, so edits are still picked
+up.
+
+.. code-block:: yaml
+
+    ext_pillar:
+      - stack_cache:
+          root: /srv/salt/current/pillar
+          size: 128
+
+Values are merged like pillarstack's default ``merge-last`` strategy: dicts
+are merged recursively, lists are appended to and anything else is replaced.
+Encrypted values are cached as ciphertext and decrypted by the ``gpg``
+ext_pillar that runs after this one.
+"""
+
+import collections
+import copy
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import types
+
+import jinja2
+import salt.utils.jinja
+import salt.utils.yaml
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 128
+CACHE_DIR = "stack_cache"
+
+# Front of the LRU for this process, keyed like the files on disk. The master
+# builds a new loader, and so a new module object, for every pillar compile,
+# so it lives in a holder module registered in sys.modules that every copy of
+# this module in the process shares.
+_STATE_MODULE = "salt_ext_pillar_stack_cache_state"
+_STATE = types.ModuleType(_STATE_MODULE)
+_STATE.memory = collections.OrderedDict()
+_STATE.lock = threading.Lock()
+_STATE = sys.modules.setdefault(_STATE_MODULE, _STATE)
+
+
+def _merge(stack, obj):
+    for key, value in obj.items():
+        if key not in stack or type(stack[key]) is not type(value):
+            stack[key] = value
+        elif isinstance(value, dict):
+            _merge(stack[key], value)
+        elif isinstance(value, list):
+            stack[key] = stack[key] + value
+        else:
+            stack[key] = value
+    return stack
+
+
+def _render_layers(root, patterns, context, undefined=jinja2.Undefined):
+    """
+    Renders and merges every file matching ``patterns``, relative to ``root``.
+    Patterns that match nothing are skipped.
+    """
+
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(root),
+        extensions=["jinja2.ext.do", salt.utils.jinja.SerializerExtension],
+        undefined=undefined,
+    )
+    env.globals.update(context)
+
+    stack = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            try:
+                obj = salt.utils.yaml.safe_load(env.get_template(name).render())
+            except Exception as e:
+                raise Exception(f"Stack pillar error in {path}:\n{e}")
+            if isinstance(obj, dict):
+                _merge(stack, obj)
+    return stack
+
+
+def _revision(revision_file):
+    try:
+        with open(revision_file) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        log.debug("No REVISION at %s, caching by file times", revision_file)
+        return None
+
+
+def _fingerprint(root):
+    """
+    Identifies the state of the files under ``root`` by their paths, sizes
+    and modification times, for when there is no ``REVISION`` to go by. Covers
+    the whole tree rather than just the shared layers, since those can import
+    or include any other file in it.
+    """
+
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except (IOError, OSError):
+                continue
+            files.append([os.path.relpath(path, root), stat.st_size, stat.st_mtime_ns])
+    return files
+
+
+def _cache_dir():
+    return os.path.join(__opts__["cachedir"], CACHE_DIR)
+
+
+def _read_disk(key):
+    path = os.path.join(_cache_dir(), key + ".pickle")
+    try:
+        with open(path, "rb") as f:
+            stack = pickle.load(f)
+        os.utime(path)
+        return stack
+    except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+
+
+def _write_disk(key, stack, size):
+    """
+    Pickles the merged layers, rather than writing JSON, so that a disk cache
+    hit gives back the same types as a fresh render (dates, sets, binary
+    values and non-string keys).
+    """
+
+    cache_dir = _cache_dir()
+    tmp = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".stack")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(stack, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, os.path.join(cache_dir, key + ".pickle"))
+        tmp = None
+
+        # Also prunes the .json files older versions of this module wrote
+        entries = glob.glob(os.path.join(cache_dir, "*"))
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:-size]:
+            os.remove(path)
+    except (IOError, OSError, TypeError, ValueError, pickle.PicklingError) as e:
+        log.warning("Could not write stack pillar cache in %s: %s", cache_dir, e)
+    finally:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _shared_layers(root, roles, revision, size):
+    """
+    Returns a copy of the merged common and role layers for ``roles``,
+    rendering them only if they aren't cached yet.
+    """
+
+    release = revision if revision is not None else _fingerprint(root)
+    key = hashlib.sha256(
+        json.dumps([os.path.realpath(root), release, roles]).encode()
+    ).hexdigest()
+
+    with _STATE.lock:
+        stack = _STATE.memory.get(key)
+        if stack is not None:
+            _STATE.memory.move_to_end(key)
+            return copy.deepcopy(stack)
+
+    stack = _read_disk(key)
+    if stack is None:
+        log.debug("Rendering stack pillar for roles %s at %s", roles, revision)
+        patterns = ["common/*.yml"] + [f"roles/{role}.yml" for role in roles]
+        context = {
+            "__opts__": {k: v for k, v in __opts__.items() if k != "grains"},
+            "roles": roles,
+            "revision": revision,
+        }
+        # Strict, so that a shared layer referring to __grains__ or __salt__
+        # fails instead of caching one minion's (or the master's) values for all
+        stack = _render_layers(root, patterns, context, jinja2.StrictUndefined)
+        _write_disk(key, stack, size)
+
+    with _STATE.lock:
+        _STATE.memory[key] = stack
+        while len(_STATE.memory) > size:
+            _STATE.memory.popitem(last=False)
+    return copy.deepcopy(stack)
+
+
+def ext_pillar(minion_id, pillar, root, size=DEFAULT_SIZE, revision_file=None):
+    """
+    Returns the stacked pillar for ``minion_id``.
+
+    Args:
+        root: The pillar directory holding common/, roles/, minion/ and nodes/
+        size: Number of role sets to keep cached
+        revision_file: Defaults to ``REVISION`` in the parent of ``root``
+    """
+
+    if revision_file is None:
+        revision_file = os.path.join(os.path.dirname(root.rstrip("/")), "REVISION")
+
+    roles = sorted(set(__grains__.get("roles", [])))
+    revision = _revision(revision_file)
+    stack = _shared_layers(root, roles, revision, size)
+
+    context = {
+        "__opts__": __opts__,
+        "__salt__": __salt__,
+        "__grains__": __grains__,
+        "minion_id": minion_id,
+        "pillar": pillar,
+        "roles": roles,
+        "revision": revision,
+    }
+    node = _render_layers(root, ["minion/*.yml", f"nodes/{minion_id}.yml"], context)
+    stack = _merge(stack, node)
+    # The release these pillars come from, reported by the common.revision
+    # state for the state_timing returner
+    return _merge(stack, {"salt": {"revision": revision}})
@@ -0,0 +1,184 @@
+"""
+Master event returner that records how long each state takes
+
+Enable it on the master, limited to job returns:
+
+.. code-block:: yaml
+
+    event_return: state_timing
+    event_return_whitelist:
+      - salt/job/*/ret/*
+
+For every highstate or state.apply/sls return (including ones run through
+``staggered.highstate``), one row per state is appended to a daily file under
+``<cachedir>/state_timing/``: the time, minion, release ``REVISION``, the
+minion's roles, state ID, state function, duration in ms and ``__run_num__``.
+Files older than ``state_timing_keep_days`` (default 14) are removed.
+
+The ``REVISION`` is the one the minion rendered its states from, which the
+``common.revision`` state reports from the ``salt:revision`` pillar. Returns
+that don't include that state (e.g. a ``state.sls`` of something else) fall
+back to the master's current ``REVISION``, read from
+``state_timing_revision_file`` (default ``/srv/salt/current/REVISION``).
+
+Use the ``state_timing`` runner to report on them.
+"""
+
+import json
+import logging
+import os
+import time
+
+import salt.cache
+
+log = logging.getLogger(__name__)
+
+__virtualname__ = "state_timing"
+
+DATA_DIR = "state_timing"
+DEFAULT_KEEP_DAYS = 14
+DEFAULT_REVISION_FILE = "/srv/salt/current/REVISION"
+STATE_FUNCTIONS = (
+    "state.apply",
+    "state.highstate",
+    "state.sls",
+    "staggered.highstate",
+)
+# The state whose name is the REVISION the minion's states were rendered from
+REVISION_STATE_ID = "common.revision::revision"
+# How long to remember a minion's roles before reading the cache again
+ROLES_TTL = 300
+
+if "_ROLES" not in globals():
+    _ROLES = {}
+
+
+def __virtual__():
+    return __virtualname__
+
+
+def _data_dir():
+    return os.path.join(__opts__["cachedir"], DATA_DIR)
+
+
+def _revision():
+    revision_file = __opts__.get("state_timing_revision_file", DEFAULT_REVISION_FILE)
+    try:
+        with open(revision_file) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _job_revision(ret):
+    """
+    Returns the REVISION a job return reports it ran, or None if it doesn't
+    include the ``common.revision`` state.
+    """
+
+    states = ret.get("return")
+    if not isinstance(states, dict):
+        return None
+    for state in states.values():
+        if isinstance(state, dict) and state.get("__id__") == REVISION_STATE_ID:
+            return state.get("name") or None
+    return None
+
+
+def _roles(minion_id):
+    cached = _ROLES.get(minion_id)
+    if cached is not None and time.monotonic() - cached[0] < ROLES_TTL:
+        return cached[1]
+
+    roles = []
+    try:
+        data = salt.cache.factory(__opts__).fetch(f"minions/{minion_id}", "data")
+        roles = sorted((data or {}).get("grains", {}).get("roles", []))
+    except Exception as e:
+        log.debug("Could not read cached grains for %s: %s", minion_id, e)
+    _ROLES[minion_id] = (time.monotonic(), roles)
+    return roles
+
+
+def _duration(value):
+    """
+    Returns a state's duration in ms; older Salt versions report it as a
+    string like ``"12.3 ms"``.
+    """
+
+    if isinstance(value, str):
+        value = value.split()[0]
+    try:
+        return round(float(value), 3)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rows(ret, revision, now):
+    """
+    Yields one row per state in a job return.
+    """
+
+    states = ret.get("return")
+    if not isinstance(states, dict):
+        return
+
+    minion_id = ret.get("id")
+    for key, state in states.items():
+        if not isinstance(state, dict) or "__run_num__" not in state:
+            continue
+        duration = _duration(state.get("duration"))
+        if duration is None:
+            continue
+        # Keys look like <state>_|-<id>_|-<name>_|-<function>
+        parts = key.split("_|-")
+        fun = f"{parts[0]}.{parts[-1]}" if len(parts) == 4 else key
+        yield [
+            round(now, 3),
+            minion_id,
+            revision,
+            _roles(minion_id),
+            state.get("__id__", parts[1] if len(parts) == 4 else key),
+            fun,
+            duration,
+            state["__run_num__"],
+        ]
+
+
+def _prune(keep_days):
+    cutoff = time.strftime("%Y-%m-%d", time.gmtime(time.time() - keep_days * 86400))
+    for name in os.listdir(_data_dir()):
+        if name.endswith(".jsonl") and name[: -len(".jsonl")] < cutoff:
+            os.remove(os.path.join(_data_dir(), name))
+
+
+def event_return(events):
+    """
+    Records the state timings from the job returns among ``events``.
+    """
+
+    now = time.time()
+    current = None
+    lines = []
+    for event in events:
+        data = event.get("data", {})
+        if not event.get("tag", "").startswith("salt/job/"):
+            continue
+        if data.get("fun") not in STATE_FUNCTIONS:
+            continue
+        revision = _job_revision(data)
+        if revision is None:
+            if current is None:
+                current = _revision()
+            revision = current
+        for row in _rows(data, revision, now):
+            lines.append(json.dumps(row, separators=(",", ":")))
+
+    if not lines:
+        return
+
+    os.makedirs(_data_dir(), exist_ok=True)
+    day = time.strftime("%Y-%m-%d", time.gmtime(now))
+    with open(os.path.join(_data_dir(), f"{day}.jsonl"), "a") as f:
+        f.write("\n".join(lines) + "\n")
+    _prune(__opts__.get("state_timing_keep_days", DEFAULT_KEEP_DAYS))
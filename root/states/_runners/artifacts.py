@@ -0,0 +1,321 @@
+"""
+Keeps a cache of release artifacts on the master, served to minions from the
+``salt://`` fileserver
+
+Every version of a product pinned in the release's pillar files is downloaded
+once, checked once against the release's SHA256SUMS, and stored with its
+hash:
+
+.. code-block:: text
+
+    <artifacts_file_root>/artifacts/<product>/<version>/<file>
+    <artifacts_file_root>/artifacts/<product>/<version>/<file>.sha256
+
+States then use ``salt://artifacts/<product>/<version>/<file>`` as the source
+and the ``.sha256`` file next to it as the ``source_hash``, so minions only
+ever talk to the master. A state that finds its version missing asks for it
+with ``publish.runner`` (``artifacts.fetch`` has to be allowed in
+``peer_run``). Versions neither the current nor the new release pins anymore
+are removed.
+
+``artifacts_file_root`` (default ``/srv/artifacts``) has to be listed in
+``file_roots``. Products are configured under ``artifacts`` in the master
+config, and Consul's linux_amd64 release from releases.hashicorp.com is set
+up by default (see `DEFAULT_ARTIFACTS`). ``url`` and ``sums`` can also be
+``file://`` URLs, e.g. to test against a local copy of the releases, and
+``keep`` lists versions to keep even if nothing pins them:
+
+.. code-block:: yaml
+
+    file_roots:
+      base:
+        - /srv/salt/current/states
+        - /srv/artifacts
+    artifacts:
+      consul:
+        url: file:///srv/mirror/consul_{version}_linux_amd64.zip
+        sums: file:///srv/mirror/consul_{version}_SHA256SUMS
+        pillar: consul:version
+        keep:
+          - 1.4.4
+
+CLI Example:
+
+.. code-block:: bash
+
+    salt-run artifacts.sync
+    salt-run artifacts.sync release=/srv/salt/releases/1570000000000
+    salt-run artifacts.fetch consul 1.5.2
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+import urllib.request
+
+import salt.utils.data
+import yaml
+from salt import exceptions
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FILE_ROOT = "/srv/artifacts"
+DEFAULT_CURRENT_RELEASE = "/srv/salt/current"
+DEFAULT_ARTIFACTS = {
+    "consul": {
+        "url": "https://releases.hashicorp.com/consul/{version}/"
+        "consul_{version}_linux_amd64.zip",
+        "sums": "https://releases.hashicorp.com/consul/{version}/"
+        "consul_{version}_SHA256SUMS",
+        "pillar": "consul:version",
+    }
+}
+DOWNLOAD_TIMEOUT = 30
+# Versions a minion may ask for through peer_run: release numbers only, so a
+# version can't point a path or URL anywhere else
+VERSION = re.compile(r"^\d+(\.\d+){1,3}([-+][0-9A-Za-z.]+)?$")
+CHUNK_SIZE = 1024 * 1024
+
+
+def _root():
+    return os.path.join(
+        __opts__.get("artifacts_file_root", DEFAULT_FILE_ROOT), "artifacts"
+    )
+
+
+def _products():
+    products = {name: dict(spec) for name, spec in DEFAULT_ARTIFACTS.items()}
+    for name, spec in (__opts__.get("artifacts") or {}).items():
+        products[name] = dict(products.get(name, {}), **(spec or {}))
+    return products
+
+
+def _product(product):
+    products = _products()
+    if product not in products:
+        raise exceptions.SaltInvocationError(
+            f"Unknown artifact {product}; configure it under artifacts"
+        )
+    return products[product]
+
+
+@contextlib.contextmanager
+def _locked():
+    """
+    Holds an exclusive lock on the cache, so that runs started by two deploys
+    at once don't download the same file twice or prune each other's work.
+    """
+
+    os.makedirs(_root(), exist_ok=True)
+    with open(os.path.join(_root(), ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _expected_hash(sums_url, filename):
+    with urllib.request.urlopen(sums_url, timeout=DOWNLOAD_TIMEOUT) as resp:
+        sums = resp.read().decode()
+    for line in sums.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip("*") == filename:
+            return parts[0].lower()
+    raise exceptions.CommandExecutionError(f"{filename} is not in {sums_url}")
+
+
+def _download(url, path):
+    """
+    Streams ``url`` into ``path``, returning the SHA256 of what was written.
+    """
+
+    digest = hashlib.sha256()
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as resp:
+        with open(path, "wb") as f:
+            for chunk in iter(lambda: resp.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}."
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def _version_dir(product, version):
+    if not VERSION.match(version):
+        raise exceptions.SaltInvocationError(
+            f"Invalid {product} version {version!r}"
+        )
+    product_dir = os.path.realpath(os.path.join(_root(), product))
+    version_dir = os.path.realpath(os.path.join(product_dir, version))
+    if os.path.dirname(version_dir) != product_dir:
+        raise exceptions.SaltInvocationError(
+            f"{product} version {version!r} is outside of {product_dir}"
+        )
+    return version_dir
+
+
+def _fetch(product, version):
+    spec = _product(product)
+    version_dir = _version_dir(product, version)
+    url = spec["url"].format(version=version)
+    filename = os.path.basename(urllib.parse.urlparse(url).path)
+    path = os.path.join(version_dir, filename)
+    hash_path = f"{path}.sha256"
+
+    # The hash file is only written once the download has been verified
+    if os.path.exists(hash_path) and os.path.exists(path):
+        with open(hash_path) as f:
+            return {"path": path, "sha256": f.read().split()[0], "fetched": False}
+
+    expected = _expected_hash(spec["sums"].format(version=version), filename)
+    os.makedirs(version_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=version_dir, prefix=f".{filename}.")
+    os.close(fd)
+    try:
+        actual = _download(url, tmp)
+        if actual != expected:
+            raise exceptions.CommandExecutionError(
+                f"SHA256 of {url} is {actual}, expected {expected}"
+            )
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    _write_atomic(hash_path, f"{expected}  {filename}\n")
+    log.info("Cached %s %s from %s", product, version, url)
+    return {"path": path, "sha256": expected, "fetched": True}
+
+
+def fetch(product, version):
+    """
+    Downloads and verifies one version of a product, unless it is cached
+    already. States call this through ``publish.runner`` for a version that
+    isn't cached yet, e.g. one only set in a templated pillar file.
+
+    Returns:
+        A dict with the artifact's ``path`` and ``sha256``, and whether it was
+        ``fetched`` by this call
+    """
+
+    with _locked():
+        return _fetch(product, str(version))
+
+
+def _release_dir(release=None):
+    current = __opts__.get("artifacts_current_release", DEFAULT_CURRENT_RELEASE)
+    return (release or current).rstrip("/")
+
+
+def _pillar_versions(release, key):
+    """
+    Yields every value of ``key`` set in the YAML pillar files of
+    ``release``. Files that aren't plain YAML (e.g. ones templated with
+    grains) are skipped; a version only set there is fetched on demand when a
+    minion renders it (see `fetch`).
+    """
+
+    pillar_dir = os.path.join(release, "pillar")
+    for root, dirs, files in os.walk(pillar_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith((".yml", ".yaml", ".sls")):
+                continue
+            path = os.path.join(root, name)
+            try:
+                with open(path) as f:
+                    data = yaml.safe_load(f)
+            except (IOError, OSError, yaml.YAMLError) as e:
+                log.debug("Not reading versions from %s: %s", path, e)
+                continue
+            if isinstance(data, dict):
+                version = salt.utils.data.traverse_dict_and_list(data, key)
+                if version:
+                    yield str(version)
+
+
+def pinned(release=None):
+    """
+    Returns the versions of each product pinned in the pillar files of the
+    current release, and of ``release`` if given, plus the ones configured to
+    be kept, as a dict of product to sorted versions.
+
+    Args:
+        release: Also read this release directory, e.g. a new release that is
+            about to be promoted; the current one is still read so that the
+            versions minions render right now aren't pruned
+    """
+
+    releases = {_release_dir(), _release_dir(release)}
+    versions = {}
+    for product, spec in _products().items():
+        found = {str(v) for v in spec.get("keep", [])}
+        for release_dir in releases:
+            found.update(_pillar_versions(release_dir, spec["pillar"]))
+        versions[product] = sorted(found)
+    return versions
+
+
+def sync(prune=True, release=None):
+    """
+    Makes sure every pinned version (see `pinned`) is cached, then removes the
+    cached versions that aren't pinned anymore.
+
+    Deploys run this with ``release`` set to the new release before promoting
+    it, so its artifacts are in place before any minion can render it.
+
+    Nothing is pruned for a product that has no version pinned or kept at
+    all, e.g. when no release has been deployed yet.
+
+    Returns:
+        A dict of product to the versions ``fetched``, already ``cached``,
+        ``pruned``, and any ``errors`` by version
+    """
+
+    report = {}
+    with _locked():
+        for product, versions in pinned(release).items():
+            result = {"fetched": [], "cached": [], "pruned": [], "errors": {}}
+            if not versions:
+                log.warning(
+                    "No %s version is pinned under %s in the release's pillar",
+                    product,
+                    _product(product)["pillar"],
+                )
+            for version in versions:
+                try:
+                    fetched = _fetch(product, version)["fetched"]
+                except Exception as e:
+                    log.error("Could not cache %s %s: %s", product, version, e)
+                    result["errors"][version] = str(e)
+                    continue
+                result["fetched" if fetched else "cached"].append(version)
+
+            product_dir = os.path.join(_root(), product)
+            if prune and versions and os.path.isdir(product_dir):
+                for version in sorted(os.listdir(product_dir)):
+                    if version not in versions:
+                        shutil.rmtree(os.path.join(product_dir, version))
+                        result["pruned"].append(version)
+            report[product] = result
+
+    if any(result["errors"] for result in report.values()):
+        __context__["retcode"] = 1
+    return report
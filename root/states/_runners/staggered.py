@@ -0,0 +1,42 @@
+"""
+Runner the ``staggered`` exec module asks, through ``peer_run``, whether a
+scheduled highstate is worth running
+
+.. code-block:: yaml
+
+    peer_run:
+      .*:
+        - staggered.status
+"""
+
+import os
+
+DEFAULT_REVISION_FILE = "/srv/salt/current/REVISION"
+
+
+def status():
+    """
+    Returns the current release ``REVISION`` (None if there isn't one) and the
+    master's 1 minute load average per CPU.
+
+    The REVISION file is read from ``staggered_revision_file`` in the master
+    config, by default ``/srv/salt/current/REVISION``.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run staggered.status
+    """
+
+    revision_file = __opts__.get("staggered_revision_file", DEFAULT_REVISION_FILE)
+    try:
+        with open(revision_file) as f:
+            revision = f.read().strip()
+    except (IOError, OSError):
+        revision = None
+
+    return {
+        "revision": revision,
+        "load": round(os.getloadavg()[0] / (os.cpu_count() or 1), 2),
+    }
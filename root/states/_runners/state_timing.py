@@ -0,0 +1,143 @@
+"""
+Reports on the state timings recorded by the ``state_timing`` returner
+
+CLI Example:
+
+.. code-block:: bash
+
+    salt-run state_timing.report
+    salt-run state_timing.report by=role days=7
+    salt-run state_timing.compare <old revision> <new revision>
+"""
+
+import json
+import math
+import os
+import time
+
+from salt import exceptions
+
+DATA_DIR = "state_timing"
+GROUPINGS = ("state", "role", "revision", "minion")
+
+
+def _rows(days, revision=None, role=None, state=None):
+    data_dir = os.path.join(__opts__["cachedir"], DATA_DIR)
+    since = time.time() - float(days) * 86400
+    first_day = time.strftime("%Y-%m-%d", time.gmtime(since))
+    try:
+        names = sorted(os.listdir(data_dir))
+    except (IOError, OSError):
+        return
+
+    for name in names:
+        if not name.endswith(".jsonl") or name[: -len(".jsonl")] < first_day:
+            continue
+        with open(os.path.join(data_dir, name)) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                ts, _, row_revision, roles, state_id, fun = row[:6]
+                if ts < since:
+                    continue
+                if revision is not None and row_revision != revision:
+                    continue
+                if role is not None and role not in roles:
+                    continue
+                if state is not None and state not in (state_id, fun):
+                    continue
+                yield row
+
+
+def _percentile(values, percent):
+    # Nearest-rank, on sorted values
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def _summarise(groups, top):
+    report = []
+    for key, durations in groups.items():
+        durations.sort()
+        report.append(
+            {
+                "key": key,
+                "count": len(durations),
+                "p50_ms": _percentile(durations, 50),
+                "p95_ms": _percentile(durations, 95),
+                "total_s": round(sum(durations) / 1000, 3),
+            }
+        )
+    report.sort(key=lambda entry: entry["p95_ms"], reverse=True)
+    return report[: int(top)] if top else report
+
+
+def report(by="state", days=1, top=20, revision=None, role=None, state=None):
+    """
+    Returns p50/p95 durations per state, slowest p95 first.
+
+    Args:
+        by: Group by ``state`` (state ID and function), or by ``role``,
+            ``revision`` or ``minion`` and state
+        days: How many days of timings to include
+        top: Number of groups to return, 0 for all
+        revision: Only include runs of this release REVISION
+        role: Only include minions with this role
+        state: Only include this state ID or function (e.g.
+            ``consul_token.manage``)
+
+    Returns:
+        A list of dicts with ``key``, ``count``, ``p50_ms``, ``p95_ms`` and
+        ``total_s``
+    """
+
+    if by not in GROUPINGS:
+        raise exceptions.SaltInvocationError(
+            f"by must be one of {', '.join(GROUPINGS)}"
+        )
+
+    groups = {}
+    for row in _rows(days, revision=revision, role=role, state=state):
+        _, minion_id, row_revision, roles, state_id, fun, duration = row[:7]
+        name = f"{state_id} ({fun})"
+        if by == "state":
+            keys = [name]
+        elif by == "role":
+            keys = [f"{r}: {name}" for r in roles or ["<none>"]]
+        elif by == "revision":
+            keys = [f"{row_revision}: {name}"]
+        else:
+            keys = [f"{minion_id}: {name}"]
+        for key in keys:
+            groups.setdefault(key, []).append(duration)
+
+    return _summarise(groups, top)
+
+
+def compare(old, new, days=14, top=20, threshold=1.2):
+    """
+    Compares the p95 duration of each state between two release REVISIONs and
+    returns the states that got slower by more than ``threshold`` times,
+    biggest regression first.
+    """
+
+    before = {e["key"]: e for e in report(days=days, top=0, revision=old)}
+    after = {e["key"]: e for e in report(days=days, top=0, revision=new)}
+
+    regressions = []
+    for key, entry in after.items():
+        if key not in before or not before[key]["p95_ms"]:
+            continue
+        ratio = entry["p95_ms"] / before[key]["p95_ms"]
+        if ratio > float(threshold):
+            regressions.append(
+                {
+                    "key": key,
+                    "ratio": round(ratio, 2),
+                    "old_p95_ms": before[key]["p95_ms"],
+                    "new_p95_ms": entry["p95_ms"],
+                }
+            )
+    regressions.sort(key=lambda entry: entry["ratio"], reverse=True)
+    return regressions[: int(top)] if top else regressions
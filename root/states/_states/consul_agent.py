@@ -0,0 +1,180 @@
+"""
+Manages the local Consul agent's config file, services and checks, reloading
+or restarting the agent only when a change needs it
+"""
+
+import json
+import os
+import tempfile
+
+# Config the agent picks up on ``consul reload``, as dotted paths into the
+# config file. A change to anything else needs a restart.
+# See: https://www.consul.io/docs/agent/options.html#reloadable-configuration
+RELOADABLE_CONFIG = (
+    "acl.tokens",
+    "acl_agent_token",
+    "acl_token",
+    "addresses.http",
+    "addresses.https",
+    "ca_file",
+    "ca_path",
+    "cert_file",
+    "check",
+    "checks",
+    "discard_check_output",
+    "key_file",
+    "log_level",
+    "node_meta",
+    "service",
+    "services",
+    "telemetry.prefix_filter",
+    "watches",
+)
+
+
+def _changed_paths(old, new, prefix=""):
+    """
+    Returns the dotted paths of every value that differs between two configs,
+    without the values themselves (they may be secrets).
+    """
+
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return [] if old == new else [prefix]
+
+    paths = []
+    for key in sorted(set(old) | set(new)):
+        path = f"{prefix}.{key}" if prefix else key
+        if key not in old or key not in new:
+            paths.append(path)
+        else:
+            paths.extend(_changed_paths(old[key], new[key], path))
+    return paths
+
+
+def _reloadable(path, reloadable):
+    return any(path == r or path.startswith(f"{r}.") for r in reloadable)
+
+
+def _write_json(path, data):
+    # mkstemp creates the file readable by its owner only
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".consul-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4, sort_keys=True)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def config(name, config, service="consul", reloadable=RELOADABLE_CONFIG):
+    """
+    Ensures the agent's JSON config file holds ``config``, then applies a
+    change in the cheapest way the agent allows:
+
+    - If the agent isn't running, the file is only written; starting the
+      service picks it up.
+    - If only reloadable settings changed (see `RELOADABLE_CONFIG`), the
+      agent is reloaded, which is what ``consul reload`` does.
+    - Otherwise the agent is restarted.
+
+    The changes only list the paths that changed, never their values.
+
+    Args:
+        name: Path of the config file
+        config: The config, as a dict
+        service: The agent's service name
+        reloadable: Dotted config paths the agent can reload
+    """
+
+    ret = {"name": name, "result": True, "changes": {}, "comment": ""}
+
+    try:
+        with open(name) as f:
+            current = json.load(f)
+    except (IOError, OSError, ValueError):
+        current = None
+
+    if current == config:
+        ret["comment"] = f"{name} is up to date"
+        return ret
+
+    paths = _changed_paths(current, config) if current is not None else [name]
+    if not __salt__["service.status"](service):
+        action = None
+    elif current is not None and all(_reloadable(p, reloadable) for p in paths):
+        action = "reload"
+    else:
+        action = "restart"
+
+    ret["changes"] = {"changed": paths}
+    if action:
+        ret["changes"]["service"] = action
+    then = f", then {service} {action}ed" if action else ""
+
+    if __opts__["test"]:
+        ret["result"] = None
+        ret["comment"] = f"{name} would be updated{then}"
+        return ret
+
+    _write_json(name, config)
+    if action and not __salt__[f"service.{action}"](service):
+        ret["result"] = False
+        ret["comment"] = f"{name} was updated, but {service} could not be {action}ed"
+        return ret
+
+    ret["comment"] = f"{name} was updated{then}"
+    return ret
+
+
+def services(
+    name, services=None, checks=None, consul_host=None, consul_token=None, prune=True
+):
+    """
+    Ensures the agent has exactly the given services and checks registered,
+    through the agent API rather than config files, so no reload or restart
+    is needed. See ``consul.reconcile_agent`` for how they are diffed.
+
+    Setting ``consul:stats_in_comment`` appends a summary of the Consul
+    requests made to the comment.
+
+    Args:
+        services: A dict of service definitions keyed by name, defaulting to
+            the ``consul:services`` pillar
+        checks: A dict of check definitions keyed by name, defaulting to the
+            ``consul:checks`` pillar
+        prune: Deregister services and checks this state registered before
+            that are no longer given
+    """
+
+    ret = {"name": name, "result": True, "changes": {}, "comment": ""}
+
+    stats_in_comment = __salt__["config.get"]("consul:stats_in_comment", False)
+    if stats_in_comment:
+        before = __salt__["consul.stats"]()
+    reconciled = __salt__["consul.reconcile_agent"](
+        services,
+        checks,
+        consul_host,
+        consul_token,
+        prune=prune,
+        test=__opts__["test"],
+    )
+
+    comments = []
+    for key, item in sorted(reconciled.items()):
+        if item["changes"]:
+            ret["changes"][key] = item["changes"]
+        if item["result"] is False:
+            ret["result"] = False
+        elif item["result"] is None and ret["result"] is True:
+            ret["result"] = None
+        if item["changes"] or item["result"] is False:
+            comments.append(item["comment"])
+
+    if not comments:
+        comments.append(f"{len(reconciled)} services and checks are up to date")
+    ret["comment"] = "\n".join(comments)
+    if stats_in_comment:
+        ret["comment"] += "\n" + __salt__["consul.stats_summary"](since=before)
+    return ret
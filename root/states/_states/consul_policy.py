@@ -3,36 +3,48 @@ Manages Consul ACL policies
 """
 
 
-def manage(name, description, rules, consul_host=None, consul_token=None):
-    ret = {"name": name, "result": True, "changes": {}, "comment": ""}
-
-    if __opts__["test"]:
-        existing = __salt__["consul.policy_from_name"](name, consul_host, consul_token)
-        if (
-            existing
-            and existing["Rules"] == rules
-            and existing["Description"] == description
-        ):
-            ret["result"] = True  # No changes
-            return ret
-
-        ret["result"] = None
-        ret[
-            "comment"
-        ] = f"Policy {name} would be {'updated' if existing else 'created'}"
-        return ret
-
-    try:
-        created, ret["changes"] = __salt__["consul.create_update_policy"](
-            name=name,
-            description=description,
-            rules=rules,
-            consul_host=consul_host,
-            consul_token=consul_token,
-        )
-        ret["comment"] = f"Policy {name} was {'created' if created else 'updated'}"
-    except Exception as e:
-        ret["result"] = False
-        ret["comment"] = f"Error updating or creating policy: {e.__repr__()}"
-
-    return ret
+def _desired(chunk):
+    return {
+        "name": chunk["name"],
+        "description": chunk.get("description"),
+        "rules": chunk.get("rules"),
+    }
+
+
+def mod_aggregate(low, chunks, running):
+    """
+    Collects every pending ``consul_policy.manage`` chunk that talks to the
+    same consul host with the same token into the ``aggregated`` argument of
+    the current chunk, so they can be reconciled in a single pass. See
+    ``consul_acl.aggregate_chunks``.
+    """
+
+    return __utils__["consul_acl.aggregate_chunks"](low, chunks, running, _desired)
+
+
+def manage(
+    name, description, rules, consul_host=None, consul_token=None, aggregated=None
+):
+    """
+    Ensures a Consul ACL policy exists with the given rules and description.
+
+    When state aggregation is enabled (``aggregate: true`` on the state, or
+    ``state_aggregate`` in the minion config), ``mod_aggregate`` passes every
+    pending policy for the same host and token in ``aggregated``. The first
+    chunk then reconciles all of them with ``consul.reconcile_policies`` and
+    the remaining chunks return the results it stored for them. See
+    ``consul_acl.manage``.
+
+    Setting ``consul:stats_in_comment`` appends a summary of the Consul
+    requests made by the reconcile to the comment of the chunk that ran it.
+    """
+
+    desired = aggregated or [{"name": name, "description": description, "rules": rules}]
+    return __utils__["consul_acl.manage"](
+        __salt__,
+        __context__,
+        "policies",
+        (consul_host, consul_token, name),
+        desired,
+        __opts__["test"],
+    )
@@ -3,50 +3,66 @@ Manages Consul ACL tokens
 """
 
 
+def _desired(chunk):
+    return {
+        "name": chunk["name"],
+        "secret": chunk.get("secret"),
+        "description": chunk.get("description"),
+        "policies": chunk.get("policies", []),
+        "roles": chunk.get("roles", []),
+    }
+
+
+def mod_aggregate(low, chunks, running):
+    """
+    Collects every pending ``consul_token.manage`` chunk that talks to the
+    same consul host with the same token into the ``aggregated`` argument of
+    the current chunk, so they can be reconciled in a single pass. See
+    ``consul_acl.aggregate_chunks``.
+    """
+
+    return __utils__["consul_acl.aggregate_chunks"](low, chunks, running, _desired)
+
+
 def manage(
-    name, secret, consul_host, consul_token, description=None, policies=[], roles=[]
+    name,
+    secret,
+    consul_host,
+    consul_token,
+    description=None,
+    policies=[],
+    roles=[],
+    aggregated=None,
 ):
-    ret = {"name": name, "result": True, "changes": {}, "comment": ""}
-
-    if __opts__["test"]:
-        existing = __salt__["consul.token_by_name_or_accessor"](
-            consul_host=consul_host, consul_token=consul_token, name=name
-        )
-
-        if existing:
-            existing_policy_names, existing_role_names = __salt__[
-                "consul.token_link_names"
-            ](existing)
-
-            if (
-                existing["Description"] == description
-                and sorted(existing_policy_names) == sorted(policies)
-                and sorted(existing_role_names) == sorted(roles)
-            ):
-                ret["result"] = True  # No changes
-                return ret
-
-            ret["result"] = None
-            ret["comment"] = f"Token {name} would be updated"
-        else:
-            ret["result"] = None
-            ret["comment"] = f"Token {name} would be created"
-
-        return ret
-
-    try:
-        created, ret["changes"] = __salt__["consul.create_update_token"](
-            name=name,
-            secret=secret,
-            description=description,
-            policies=policies,
-            roles=roles,
-            consul_host=consul_host,
-            consul_token=consul_token,
-        )
-        ret["comment"] = f"Token {name} was {'created' if created else 'updated'}"
-    except Exception as e:
-        ret["result"] = False
-        ret["comment"] = f"Error updating or creating token: {e.__repr__()}"
-
-    return ret
+    """
+    Ensures a Consul ACL token exists with the given secret, description and
+    policy/role links.
+
+    When state aggregation is enabled (``aggregate: true`` on the state, or
+    ``state_aggregate`` in the minion config), ``mod_aggregate`` passes every
+    pending token for the same host and token in ``aggregated``. The first
+    chunk then reconciles all of them with ``consul.reconcile_tokens`` and
+    the remaining chunks return the results it stored for them. See
+    ``consul_acl.manage``.
+
+    Setting ``consul:stats_in_comment`` appends a summary of the Consul
+    requests made by the reconcile to the comment of the chunk that ran it.
+    """
+
+    desired = aggregated or [
+        {
+            "name": name,
+            "secret": secret,
+            "description": description,
+            "policies": policies,
+            "roles": roles,
+        }
+    ]
+    return __utils__["consul_acl.manage"](
+        __salt__,
+        __context__,
+        "tokens",
+        (consul_host, consul_token, name),
+        desired,
+        __opts__["test"],
+    )
@@ -0,0 +1,92 @@
+"""
+Keeps a running WireGuard interface in line with its config without
+restarting it
+
+Peers and the private key are changed in place through the ``wireguard`` exec
+module, so tunnels to peers that didn't change stay up. Only a change of
+address or listen port restarts the interface's ``wg-quick`` service, which
+also re-runs its PostUp/PreDown hooks.
+"""
+
+import ipaddress
+
+
+def _addresses(address):
+    if isinstance(address, str):
+        address = address.split(",")
+    return sorted(str(ipaddress.ip_interface(a.strip())) for a in address if a.strip())
+
+
+def synced(name, address, listen_port, private_key, peers=None, service=None):
+    """
+    Ensures the interface ``name`` has the given address, listen port,
+    private key and peers.
+
+    Args:
+        address: The interface's address(es), as a list or comma separated
+            string, e.g. ``192.168.16.1/24``
+        listen_port: The UDP port WireGuard listens on
+        private_key: The interface's private key
+        peers: A list of peers, as for ``wireguard.sync_peers``
+        service: The service to restart for address or port changes, by
+            default ``wg-quick@<name>``
+    """
+
+    ret = {"name": name, "result": True, "changes": {}, "comment": ""}
+    service = service or f"wg-quick@{name}"
+
+    if not __salt__["wireguard.is_up"](name):
+        if __opts__["test"]:
+            # In a dry run the service state before this one didn't start it
+            ret["result"] = None
+            ret["comment"] = (
+                f"{name} is not up; {service} would bring it up with this config"
+            )
+            return ret
+        ret["result"] = False
+        ret["comment"] = f"{name} is not up; is {service} running?"
+        return ret
+
+    current = __salt__["wireguard.show"](name)
+    restart = {}
+    current_addresses = __salt__["wireguard.addresses"](name)
+    if current_addresses != _addresses(address):
+        restart["address"] = {"old": current_addresses, "new": _addresses(address)}
+    if current["listen_port"] != int(listen_port):
+        restart["listen_port"] = {
+            "old": current["listen_port"],
+            "new": int(listen_port),
+        }
+
+    if restart:
+        # The restart brings up the whole config, peers included
+        ret["changes"] = dict(restart, service="restart")
+        if __opts__["test"]:
+            ret["result"] = None
+            ret["comment"] = f"{service} would be restarted"
+        elif __salt__["service.restart"](service):
+            ret["comment"] = f"{service} was restarted"
+        else:
+            ret["result"] = False
+            ret["comment"] = f"{service} could not be restarted"
+        return ret
+
+    if __salt__["wireguard.pubkey"](private_key) != current["public_key"]:
+        ret["changes"]["private_key"] = {"old": "<hidden>", "new": "<hidden>"}
+        if not __opts__["test"]:
+            __salt__["wireguard.set_private_key"](name, private_key)
+
+    peer_changes = __salt__["wireguard.sync_peers"](
+        name, peers or [], test=__opts__["test"]
+    )
+    if peer_changes:
+        ret["changes"]["peers"] = peer_changes
+
+    if not ret["changes"]:
+        ret["comment"] = f"{name} is up to date"
+    elif __opts__["test"]:
+        ret["result"] = None
+        ret["comment"] = f"{name} would be updated in place"
+    else:
+        ret["comment"] = f"{name} was updated in place"
+    return ret
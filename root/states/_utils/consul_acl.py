@@ -0,0 +1,106 @@
+"""
+State plumbing shared by the consul_policy and consul_token states
+
+Both states reconcile every pending ``manage`` chunk for the same consul host
+and token in a single pass: ``mod_aggregate`` collects the chunks with
+`aggregate_chunks`, the first of them reconciles all of them with `manage`,
+and the rest return the results it stored for them.
+"""
+
+import salt.utils.state
+
+# Chunk arguments that decide whether or when a chunk runs. They would be
+# bypassed if the chunk were aggregated into one that runs earlier.
+_REQUISITES = (
+    "require",
+    "watch",
+    "prereq",
+    "onchanges",
+    "onfail",
+    "use",
+    "listen",
+    "onlyif",
+    "unless",
+)
+
+
+def aggregate_chunks(low, chunks, running, desired):
+    """
+    Collects every pending ``manage`` chunk of the same state as ``low`` that
+    talks to the same consul host with the same token into the ``aggregated``
+    argument of ``low``.
+
+    Chunks with requisites of their own are left alone, since running them
+    early could break the ordering they ask for (e.g. a token requiring the
+    policy it links to).
+
+    Args:
+        desired: Returns the desired policy or token for a chunk
+
+    Returns:
+        ``low``, with ``aggregated`` set if other chunks were collected
+    """
+
+    if low.get("fun") != "manage":
+        return low
+
+    low_tag = salt.utils.state.gen_tag(low)
+    aggregated = [desired(low)]
+    for chunk in chunks:
+        tag = salt.utils.state.gen_tag(chunk)
+        if tag == low_tag or tag in running or "__agg__" in chunk:
+            continue
+        if chunk.get("state") != low.get("state") or chunk.get("fun") != "manage":
+            continue
+        if chunk.get("consul_host") != low.get("consul_host"):
+            continue
+        if chunk.get("consul_token") != low.get("consul_token"):
+            continue
+        if any(chunk.get(req) for req in _REQUISITES):
+            continue
+
+        aggregated.append(desired(chunk))
+        chunk["__agg__"] = True
+
+    if len(aggregated) > 1:
+        low["aggregated"] = aggregated
+    return low
+
+
+def manage(functions, context, kind, key, desired, test):
+    """
+    Returns the state return for one ``manage`` chunk, reconciling ``desired``
+    with ``consul.reconcile_<kind>`` unless an earlier chunk already did.
+
+    Setting ``consul:stats_in_comment`` appends a summary of the Consul
+    requests made by the reconcile to the comment of the chunk that ran it.
+
+    Args:
+        functions: The calling state's ``__salt__``
+        context: The calling state's ``__context__``, where the results for
+            the other chunks are kept until they run
+        kind: ``policies`` or ``tokens``
+        key: The chunk's (consul_host, consul_token, name)
+        desired: The chunk's own policy or token, followed by any aggregated
+            into it
+        test: Only report what would change
+    """
+
+    results = context.setdefault(f"consul_acl.{kind}_results", {})
+
+    if key not in results:
+        consul_host, consul_token, _ = key
+        stats_in_comment = functions["config.get"]("consul:stats_in_comment", False)
+        if stats_in_comment:
+            before = functions["consul.stats"]()
+        reconciled = functions[f"consul.reconcile_{kind}"](
+            desired, consul_host, consul_token, test=test
+        )
+        for name, ret in reconciled.items():
+            results[(consul_host, consul_token, name)] = ret
+        if stats_in_comment:
+            results[key]["comment"] += "\n" + functions["consul.stats_summary"](
+                since=before
+            )
+
+    return results.pop(key)
@@ -2,6 +2,6 @@ from __future__ import absolute_import
 
 from invoke import Collection
 
-from . import deploy, gpg
+from . import bench, deploy, gpg
 
-ns = Collection(deploy, gpg)
+ns = Collection(bench, deploy, gpg)
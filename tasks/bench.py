@@ -0,0 +1,25 @@
+"""
+Benchmarks for the salt modules
+"""
+
+from __future__ import absolute_import
+
+from invoke import task
+
+
+@task(
+    help={
+        "sizes": "Comma separated numbers of policies/tokens to reconcile",
+        "latency": "Seconds of latency the fake consul adds to each request",
+        "backend": "consul:backend to benchmark (requests or asyncio)",
+        "memory": "Also measure peak memory in a separate traced run",
+    }
+)
+def acl(c, sizes="10,100,1000,10000", latency=0.0, backend="requests", memory=True):
+    """
+    Benchmark consul ACL reconciliation against an in-process fake consul
+    """
+    c.run(
+        f"python -m benchmarks.consul_acl --sizes {sizes} --latency {latency} "
+        f"--config consul:backend={backend} {'' if memory else '--no-memory'}"
+    )
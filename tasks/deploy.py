@@ -1,5 +1,10 @@
 """
 Deployment tasks for salt
+
+SALT_MASTER may be a comma separated list of masters (e.g. syndics or an HA
+pair). Every task then runs against all of them at once, each master in its
+own thread with its own connection; a failure on one master stops the
+remaining stages for that master only, and is reported when all are done.
 """
 
 from __future__ import absolute_import
@@ -10,28 +15,36 @@ import tarfile
 
 import fabric
 from invoke import task
+from invoke.exceptions import Exit
 from patchwork import files
 
 from . import utils
 
-SALT_MASTER = os.getenv("SALT_MASTER")
+SALT_MASTERS = [h.strip() for h in os.getenv("SALT_MASTER", "").split(",") if h.strip()]
 SALT_REPO = os.getenv("SALT_REPO")
 SALT_USER = os.getenv("SALT_USER", "salt")
 SALT_DEPLOY_PATH = os.getenv("SALT_DEPLOY_PATH", "/srv/salt")
+# The master's extension_modules, where saltutil.sync_all installs runners
+SALT_EXTMODS_PATH = os.getenv("SALT_EXTMODS_PATH", "/var/cache/salt/master/extmods")
 SALT_BRANCH = os.getenv("SALT_BRANCH", "master")
 SALT_KEEP_RELEASES = os.getenv("SALT_KEEP_RELEASES", 5)
+# Build state releases by hard-linking the current one and writing only the
+# files changed since its REVISION
+SALT_INCREMENTAL = os.getenv("SALT_INCREMENTAL", "") not in ("", "0", "false")
 
-conn = fabric.Connection(host=SALT_MASTER, user=SALT_USER)
-conn.config.run.echo = True
-conn.config.run.hide = "out"
-conn.config.run.warn = False
 
+def _connection(host):
+    conn = fabric.Connection(host=host, user=SALT_USER)
+    conn.config.run.echo = True
+    conn.config.run.hide = "out"
+    conn.config.run.warn = False
+    return conn
 
-@task
-def setup(c):
-    """
-    Prepare the server for deployments
-    """
+
+conns = [_connection(host) for host in SALT_MASTERS]
+
+
+def _setup(conn):
     files.directory(conn, utils.join(SALT_DEPLOY_PATH, utils.DEPLOY_REPO_DIR))
     files.directory(conn, utils.join(SALT_DEPLOY_PATH, utils.DEPLOY_RELEASES_DIR))
 
@@ -43,11 +56,7 @@ def setup(c):
         conn.run(f"git fetch --depth 1 origin {SALT_BRANCH}")
 
 
-@task
-def prune(c):
-    """
-    Clean up old releases, keeping the value of SALT_KEEP_RELEASES
-    """
+def _prune(conn):
     with conn.cd(utils.join(SALT_DEPLOY_PATH, utils.DEPLOY_RELEASES_DIR)):
         releases = [
             d.replace("./", "").strip()
@@ -59,34 +68,67 @@ def prune(c):
 
         diff = len(releases) - int(SALT_KEEP_RELEASES)
         print(
-            f"Found {len(releases)} current releases; set to keep {SALT_KEEP_RELEASES}"
+            f"[{conn.host}] Found {len(releases)} current releases; "
+            f"set to keep {SALT_KEEP_RELEASES}"
         )
         if diff > 0:
             to_delete = releases[:diff]
-            print(f"Cleaning up {len(to_delete)} old release(s)")
+            print(f"[{conn.host}] Cleaning up {len(to_delete)} old release(s)")
             conn.run(f"rm -rf {' '.join(to_delete)}")
         else:
-            print("Nothing to do")
+            print(f"[{conn.host}] Nothing to do")
 
 
-@task(setup, post=[prune])
-def states(c):
-    """
-    Deploy salt states and modules into /srv/salt
-    """
+def _states(conn):
+    old_revision = utils.current_revision(conn, SALT_DEPLOY_PATH)
     release_dir = utils.new_release(
-        conn, deploy_root=SALT_DEPLOY_PATH, in_repo_path="root", branch=SALT_BRANCH
+        conn,
+        deploy_root=SALT_DEPLOY_PATH,
+        in_repo_path="root",
+        branch=SALT_BRANCH,
+        incremental=SALT_INCREMENTAL,
     )
+    _sync_artifacts(conn, release_dir)
     utils.promote_release_to_current(
         conn, deploy_root=SALT_DEPLOY_PATH, release_dir=release_dir
     )
+    _sync_master_modules(conn)
 
+    changed = utils.mirror_changed_paths(
+        conn, SALT_DEPLOY_PATH, old_revision, SALT_BRANCH, "root"
+    )
+    utils.refresh_changed(conn, changed, "root")
+
+
+def _sync_master_modules(conn):
+    # The master loads ext_pillar modules (stack_cache, gpg_cache) and runners
+    # from its extmods cache
+    conn.sudo("salt-run saltutil.sync_all", pty=True)
+
+
+def _sync_artifacts(conn, release_dir):
+    # Download any newly pinned release artifacts (e.g. a Consul version bump)
+    # from the new release's pillar before it is promoted, so minions never
+    # render a version the master doesn't have yet. If the master's runner is
+    # missing or too old to take release= (e.g. on the first deploy), the new
+    # release's runner is installed and the sync tried once more; if that
+    # fails too, the release is removed without being promoted.
+    sync = f"salt-run artifacts.sync release={release_dir}"
+    if conn.sudo(sync, pty=True, warn=True).ok:
+        return
+
+    runner = utils.join(release_dir, "states", "_runners", "artifacts.py")
+    conn.sudo(
+        f"install -D -m 644 {runner} "
+        f"{utils.join(SALT_EXTMODS_PATH, 'runners', 'artifacts.py')}",
+        pty=True,
+    )
+    if not conn.sudo(sync, pty=True, warn=True).ok:
+        conn.run(f"rm -rf {release_dir}")
+        raise Exit(f"Could not sync artifacts for {release_dir}, not promoting it")
 
-@task(setup)
-def etc(c):
-    """
-    Deploy /etc/salt configs and restart daemon
-    """
+
+def _etc(conn):
     utils.new_release(
         conn,
         deploy_root=SALT_DEPLOY_PATH,
@@ -97,11 +139,7 @@ def etc(c):
     conn.sudo("systemctl restart salt-master", pty=True)
 
 
-@task
-def gpg(c):
-    """
-    Deploy gpgkeys dir to /etc/salt
-    """
+def _gpg(conn):
     buf = io.BytesIO()
     tf = tarfile.TarFile(fileobj=buf, mode="w")
     tf.add("etc/gpgkeys", arcname="gpgkeys", recursive=True)
@@ -120,11 +158,81 @@ def gpg(c):
         conn.run(f"tar -xf {upload_path} -C /etc/salt")
 
 
-@task(setup, default=True)
+@task
+def setup(c):
+    """
+    Prepare the server for deployments
+    """
+    utils.on_hosts(conns, _setup)
+
+
+@task
+def prune(c):
+    """
+    Clean up old releases, keeping the value of SALT_KEEP_RELEASES
+    """
+    utils.on_hosts(conns, _prune)
+
+
+@task
+def states(c):
+    """
+    Deploy salt states and modules into /srv/salt
+    """
+    utils.on_hosts(conns, _setup, _states, _prune)
+
+
+@task(
+    help={
+        "ref": "Git ref to deploy; defaults to the working tree, including "
+        "uncommitted changes"
+    }
+)
+def push(c, ref=None):
+    """
+    Deploy salt states and modules from this checkout, without the remote mirror
+
+    The release is built locally, uploaded over SFTP and extracted in a single
+    remote command, so setup is not needed. Once its artifacts are synced it
+    is promoted with one more command.
+    """
+    with utils.local_release_archive("root", ref=ref) as (archive, revision):
+        print(f"Pushing {revision}")
+
+        def _push(conn):
+            old_revision = utils.current_revision(conn, SALT_DEPLOY_PATH)
+            release_dir = utils.push_release(conn, SALT_DEPLOY_PATH, archive, revision)
+            _sync_artifacts(conn, release_dir)
+            utils.promote_release_to_current(
+                conn, deploy_root=SALT_DEPLOY_PATH, release_dir=release_dir
+            )
+            _sync_master_modules(conn)
+
+            changed = utils.local_changed_paths(old_revision, revision, "root")
+            utils.refresh_changed(conn, changed, "root")
+
+        utils.on_hosts(conns, _push, _prune)
+
+
+@task
+def etc(c):
+    """
+    Deploy /etc/salt configs and restart daemon
+    """
+    utils.on_hosts(conns, _setup, _etc)
+
+
+@task
+def gpg(c):
+    """
+    Deploy gpgkeys dir to /etc/salt
+    """
+    utils.on_hosts(conns, _gpg)
+
+
+@task(default=True)
 def all(c):
     """
     Deploy all salt master files except the gpg keys dir
     """
-    states(c)
-    etc(c)
-    prune(c)
+    utils.on_hosts(conns, _setup, _states, _etc, _prune)
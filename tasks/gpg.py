@@ -1,15 +1,21 @@
 from __future__ import absolute_import, print_function
 
-from tempfile import NamedTemporaryFile
+import sys
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from textwrap import dedent
 
 from os import getenv, path
 
+import yaml
 from invoke import task
 from invoke.exceptions import Exit
 
 
 KEY_EMAIL = getenv("GPG_KEY_EMAIL")
+PILLAR_ROOT = "root/pillar"
+# RAM-backed, so plaintext written for gpg never reaches a disk. None (the
+# system temp dir) where it doesn't exist, e.g. on macOS.
+PLAINTEXT_DIR = "/dev/shm" if path.isdir("/dev/shm") else None
 
 
 @task
@@ -67,3 +73,209 @@ def encrypt(c, payload):
         f'gpg --armor --batch --trust-model always -e -r {KEY_EMAIL} <<< "{payload}"',
         pty=True,
     )
+
+
+def _read_payloads(source):
+    """
+    Reads ``target=value`` lines, or a YAML mapping of target to value, where
+    target is ``<pillar file>:<key>:<key>...``, e.g.
+    ``common/consul.yml:consul:salt_acl_token``.
+    """
+
+    if source == "-":
+        payloads = {}
+        for line in sys.stdin:
+            line = line.rstrip("\n")
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            if "=" not in line:
+                raise Exit(f"Expected target=value, got {line!r}")
+            target, value = line.split("=", 1)
+            payloads[target.strip()] = value
+        return payloads
+
+    with open(source) as f:
+        payloads = yaml.safe_load(f) or {}
+    if not isinstance(payloads, dict):
+        raise Exit(f"{source} must be a mapping of target to value")
+    return {target: str(value) for target, value in payloads.items()}
+
+
+def _encrypt_all(c, payloads):
+    """
+    Encrypts every payload with a single gpg run.
+
+    Returns:
+        A dict of target to armored ciphertext
+    """
+
+    with TemporaryDirectory(prefix="salt-encrypt", dir=PLAINTEXT_DIR) as tmp:
+        files = {}
+        for i, (target, value) in enumerate(payloads.items()):
+            files[target] = path.join(tmp, str(i))
+            # A trailing newline, like the here-string in the encrypt task
+            with open(files[target], "w") as f:
+                f.write(value + "\n")
+
+        c.run(
+            f"gpg --armor --batch --yes --trust-model always -r {KEY_EMAIL} "
+            f"--multifile --encrypt {' '.join(files.values())}"
+        )
+
+        armored = {}
+        for target, name in files.items():
+            with open(name + ".asc") as f:
+                armored[target] = f.read()
+        return armored
+
+
+def _block(value, indent):
+    """
+    Formats a multi-line value (an armored message) as a ``|`` block scalar,
+    the way the pillar files are written by hand.
+    """
+
+    lines = value.rstrip("\n").split("\n")
+    return "|\n" + "\n".join(" " * indent + line if line else "" for line in lines)
+
+
+def _line_end(text, index):
+    """
+    Returns the index just past the end of the line ``index`` is on, leaving
+    any blank lines that follow it alone.
+    """
+
+    index = len(text[:index].rstrip())
+    end = text.find("\n", index)
+    return len(text) if end == -1 else end + 1
+
+
+def _splice(text, keys, value, target):
+    """
+    Sets the value at ``keys`` in the YAML document ``text``, editing only
+    that value so comments and the layout of the rest of the file are kept.
+    Missing mapping keys are added after the last key of their parent.
+
+    Returns:
+        The new text
+    """
+
+    node = yaml.compose(text)
+    for i, key in enumerate(keys):
+        if isinstance(node, yaml.SequenceNode):
+            try:
+                node = node.value[int(key)]
+            except (ValueError, IndexError):
+                raise Exit(f"{target}: no list item {key}")
+            # Lined up with the item, like "- |" blocks written by hand
+            indent = node.start_mark.column
+            continue
+        if node is not None and not isinstance(node, yaml.MappingNode):
+            raise Exit(f"{target}: {keys[i - 1]} is not a mapping or list")
+
+        items = node.value if node is not None else []
+        found = [(k, v) for k, v in items if k.value == key]
+        if found:
+            indent = found[0][0].start_mark.column + 2
+            node = found[0][1]
+            continue
+
+        # Add the rest of the path as new keys
+        if node is not None and node.flow_style:
+            raise Exit(f"{target}: can't add {key} to a flow style mapping")
+        if items:
+            column = items[0][0].start_mark.column
+            index = _line_end(text, items[-1][1].end_mark.index)
+        else:
+            column = 0
+            index = len(text)
+        lines = [
+            " " * (column + 2 * depth) + f"{name}:"
+            for depth, name in enumerate(keys[i:])
+        ]
+        lines[-1] += " " + _block(value, column + 2 * len(keys[i:]))
+        prefix = "" if not text or text.endswith("\n") or index < len(text) else "\n"
+        return text[:index] + prefix + "\n".join(lines) + "\n" + text[index:]
+
+    if isinstance(node, (yaml.MappingNode, yaml.SequenceNode)):
+        raise Exit(f"{target}: refusing to replace a whole mapping or list")
+    start, end = node.start_mark.index, node.end_mark.index
+    # Keep the blank lines (and indentation) a block scalar's span takes in
+    old = text[start:end]
+    trailing = old[len(old.rstrip()):]
+    # An empty value (``key:``) starts right after the colon
+    space = " " if text[start - 1:start] == ":" else ""
+    return text[:start] + space + _block(value, indent) + trailing + text[end:]
+
+
+def _get_path(data, keys):
+    for key in keys:
+        data = data[int(key)] if isinstance(data, list) else data[key]
+    return data
+
+
+@task(
+    help={
+        "source": "YAML file of target: value, or - to read target=value lines "
+        "from stdin",
+        "write": "Write the results into the pillar files instead of printing",
+    }
+)
+def encrypt_batch(c, source="-", write=True):
+    """
+    Encrypt many values at once and write them into the pillar files.
+
+    Targets are a pillar file relative to root/pillar followed by a colon
+    separated key path (list items by index), e.g.
+
+        common/consul.yml:consul:salt_acl_token=s3cret
+
+    All values are encrypted with one gpg run, using your system GPG ring like
+    the encrypt task does. Only the targeted values are changed in the files,
+    so comments and formatting are kept. Files with Jinja in them are left
+    alone, since they can't be parsed before rendering.
+    """
+
+    payloads = _read_payloads(source)
+    if not payloads:
+        raise Exit("Nothing to encrypt")
+
+    by_file = {}
+    for target in payloads:
+        filename, _, keys = target.partition(":")
+        if not keys:
+            raise Exit(f"{target}: expected <pillar file>:<key path>")
+        by_file.setdefault(filename, []).append((target, keys.split(":")))
+
+    for filename in by_file:
+        with open(path.join(PILLAR_ROOT, filename)) as f:
+            text = f.read()
+            if "{{" in text or "{%" in text:
+                raise Exit(f"{filename} contains Jinja, refusing to rewrite it")
+
+    armored = _encrypt_all(c, payloads)
+    if not write:
+        for target, text in armored.items():
+            print(f"{target}:\n{text}")
+        return
+
+    for filename, targets in by_file.items():
+        pillar_file = path.join(PILLAR_ROOT, filename)
+        with open(pillar_file) as f:
+            text = f.read()
+        for target, keys in targets:
+            text = _splice(text, keys, armored[target], target)
+
+        # Only write what reads back as the values that were encrypted
+        data = yaml.safe_load(text)
+        for target, keys in targets:
+            try:
+                ok = _get_path(data, keys) == armored[target]
+            except (KeyError, IndexError, TypeError, ValueError):
+                ok = False
+            if not ok:
+                raise Exit(f"{target}: could not write the value, {filename} unchanged")
+
+        with open(pillar_file, "w") as f:
+            f.write(text)
+        print(f"Wrote {len(targets)} value(s) to {pillar_file}")
@@ -3,10 +3,18 @@ Various utility functions, mostly for deploys
 """
 from __future__ import absolute_import
 
+import hashlib
+import os
+import subprocess
+import tarfile
+import tempfile
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import PurePosixPath as path
 
+from invoke.exceptions import Exit
 from patchwork import files
 
 
@@ -28,10 +36,17 @@ def remote_tmp_dir(conn):
         conn.run(f"rm -rf {tmp_dir}")
 
 
-def new_release(conn, deploy_root, branch, in_repo_path, release_path=None):
+def new_release(
+    conn, deploy_root, branch, in_repo_path, release_path=None, incremental=False
+):
     if release_path is None:
         release_path = join(deploy_root, DEPLOY_RELEASES_DIR, int(time.time() * 1000.0))
 
+    if incremental:
+        with conn.cd(join(deploy_root, DEPLOY_REPO_DIR)):
+            _incremental_release(conn, deploy_root, branch, in_repo_path, release_path)
+        return release_path
+
     files.directory(conn, release_path)
     with conn.cd(join(deploy_root, DEPLOY_REPO_DIR)):
         conn.run(
@@ -45,7 +60,299 @@ def new_release(conn, deploy_root, branch, in_repo_path, release_path=None):
     return release_path
 
 
+def _incremental_release(conn, deploy_root, branch, in_repo_path, release_path):
+    """
+    Builds a release by hard-linking the current one and replacing only the
+    files that changed between its REVISION and ``branch``, in one remote
+    command run from the repo mirror. Unchanged files keep their inode and
+    mtime, so the fileserver cache stays valid for them.
+
+    Falls back to a full extraction if there is no current release or its
+    revision is not in the mirror.
+    """
+
+    current = join(deploy_root, DEPLOY_CURRENT_LINK)
+    extract = f"tar -x --strip-components 1 -f - -C {release_path}"
+    # Paths in the diff start with in_repo_path, which the release strips
+    strip = f"sed -z 's|^{in_repo_path}/||'"
+    conn.run(
+        f"""set -e
+            new=$(git rev-list --max-count=1 {branch})
+            old=$(cat {join(current, 'REVISION')} 2>/dev/null || true)
+            mkdir -p {release_path}
+            if [ -n "$old" ] && git cat-file -e "$old^{{commit}}" 2>/dev/null; then
+                cp -al {current}/. {release_path}/
+                rm -f {join(release_path, 'REVISION')}
+                git diff -z --name-only --no-renames "$old" "$new" -- {in_repo_path} \\
+                    | {strip} | (cd {release_path} && xargs -0 -r rm -f)
+                git diff -z --name-only --no-renames --diff-filter=d "$old" "$new" \\
+                    -- {in_repo_path} \\
+                    | xargs -0 -r sh -c 'git archive "$0" "$@" | {extract}' "$new"
+                echo "Linked release from $old, changes:"
+                git diff --stat "$old" "$new" -- {in_repo_path} | tail -n 1
+            else
+                git archive "$new" {in_repo_path} | {extract}
+            fi
+            echo "$new" > {join(release_path, 'REVISION')}"""
+    )
+
+
+def _git(*args):
+    return subprocess.run(
+        ["git"] + list(args), check=True, stdout=subprocess.PIPE
+    ).stdout.decode()
+
+
+def _dirty_digest(in_repo_path):
+    """
+    Hashes the uncommitted changes under ``in_repo_path``: the diff against
+    HEAD and the untracked files, so that two dirty pushes with different
+    changes get different revisions.
+    """
+
+    digest = hashlib.sha256()
+    digest.update(_git("diff", "--binary", "HEAD", "--", in_repo_path).encode())
+    untracked = _git("ls-files", "-z", "--others", "--exclude-standard", in_repo_path)
+    for name in sorted(untracked.split("\0")):
+        if name and os.path.isfile(name):
+            digest.update(name.encode() + b"\0")
+            with open(name, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+@contextmanager
+def local_release_archive(in_repo_path, ref=None):
+    """
+    Builds a gzipped tarball of ``in_repo_path`` in a local temp file, from
+    ``ref`` with `git archive`, or from the working tree (tracked and
+    untracked, non-ignored files) if no ref is given.
+
+    Yields:
+        A tuple of (archive path, revision); the revision of a working tree
+        with uncommitted changes ends in ``-<hash of the changes>-dirty``
+    """
+
+    with tempfile.NamedTemporaryFile(suffix=".tar.gz") as archive:
+        if ref is not None:
+            revision = _git("rev-parse", "--verify", f"{ref}^{{commit}}").strip()
+            subprocess.run(
+                ["git", "archive", "--format=tar.gz", revision, in_repo_path],
+                check=True,
+                stdout=archive,
+            )
+        else:
+            revision = _git("rev-parse", "HEAD").strip()
+            if _git("status", "--porcelain", "--", in_repo_path).strip():
+                revision += f"-{_dirty_digest(in_repo_path)}-dirty"
+            ls_files = ["ls-files", "-z", "--cached", "--others", "--exclude-standard"]
+            names = _git(*ls_files, in_repo_path).split("\0")
+            with tarfile.open(fileobj=archive, mode="w:gz") as tf:
+                for name in sorted(names):
+                    if name and os.path.exists(name):
+                        tf.add(name, recursive=False)
+        archive.flush()
+        yield archive.name, revision
+
+
+def push_release(conn, deploy_root, archive, revision):
+    """
+    Uploads a `local_release_archive` over SFTP, then extracts it into a new
+    release and writes its REVISION in one remote command. Promote it with
+    `promote_release_to_current`.
+
+    Returns:
+        The new release's path
+    """
+
+    release_path = join(deploy_root, DEPLOY_RELEASES_DIR, int(time.time() * 1000.0))
+    upload_path = f"{release_path}.tar.gz"
+
+    with conn.sftp() as sftp:
+        sftp.put(archive, upload_path)
+
+    conn.run(
+        f"""set -e
+            mkdir -p {release_path}
+            tar -xzf {upload_path} --strip-components 1 -C {release_path}
+            rm -f {upload_path}
+            echo {revision} > {join(release_path, 'REVISION')}"""
+    )
+    return release_path
+
+
+def current_revision(conn, deploy_root):
+    """
+    Returns the REVISION of the current release, or None if there isn't one.
+    """
+
+    revision_file = join(deploy_root, DEPLOY_CURRENT_LINK, "REVISION")
+    return conn.run(f"cat {revision_file} 2>/dev/null || true").stdout.strip() or None
+
+
+def mirror_changed_paths(conn, deploy_root, old, new, in_repo_path):
+    """
+    Lists the repo paths under ``in_repo_path`` that differ between two
+    revisions, using the repo mirror on the host.
+
+    Returns:
+        A list of paths, or None if ``old`` is unknown or not in the mirror
+    """
+
+    if not old:
+        return None
+    with conn.cd(join(deploy_root, DEPLOY_REPO_DIR)):
+        result = conn.run(
+            f'git cat-file -e "{old}^{{commit}}" && '
+            f"git diff --name-only {old} {new} -- {in_repo_path}",
+            warn=True,
+        )
+    if not result.ok:
+        return None
+    return result.stdout.split()
+
+
+def local_changed_paths(old, new, in_repo_path):
+    """
+    Like `mirror_changed_paths`, using the local repo. A ``-dirty`` ``new``
+    revision is compared as the working tree, untracked files included.
+    """
+
+    if not old or old.endswith("-dirty"):
+        return None
+    try:
+        _git("cat-file", "-e", f"{old}^{{commit}}")
+    except subprocess.CalledProcessError:
+        return None
+
+    if new.endswith("-dirty"):
+        paths = _git("diff", "--name-only", old, "--", in_repo_path).split()
+        paths += _git(
+            "ls-files", "--others", "--exclude-standard", in_repo_path
+        ).split()
+        return paths
+    return _git("diff", "--name-only", old, new, "--", in_repo_path).split()
+
+
+# Minion-side module types synced with saltutil.sync_all
+_SYNCED_DIRS = ("_beacons", "_grains", "_modules", "_states", "_utils")
+# Pillar directories whose files apply to every minion
+_GLOBAL_PILLAR_DIRS = ("common", "minion")
+
+
+def refresh_targets(paths, in_repo_path):
+    """
+    Works out what needs refreshing after the given repo paths changed.
+
+    Pillar changes are mapped to minions by layer: ``roles/<role>.yml`` to
+    ``G@roles:<role>``, ``nodes/<id>.yml`` to that minion, and ``common/`` or
+    ``minion/`` to everyone. With ``paths`` of None (unknown changes)
+    everything is refreshed.
+
+    Returns:
+        A dict with ``fileserver`` (bool), and ``sync`` and ``pillar``
+        compound targets (or None if there is nothing to do)
+    """
+
+    if paths is None:
+        return {"fileserver": True, "sync": "*", "pillar": "*"}
+
+    fileserver = False
+    sync = False
+    pillar_all = False
+    roles = set()
+    nodes = set()
+    for repo_path in paths:
+        parts = path(repo_path).relative_to(in_repo_path).parts
+        if parts[0] == "states":
+            fileserver = True
+            sync = sync or (len(parts) > 2 and parts[1] in _SYNCED_DIRS)
+        elif parts[0] == "pillar" and len(parts) > 2:
+            if parts[1] == "roles":
+                roles.add(path(parts[2]).stem)
+            elif parts[1] == "nodes":
+                nodes.add(path(parts[2]).stem)
+            elif parts[1] in _GLOBAL_PILLAR_DIRS:
+                pillar_all = True
+
+    pillar = None
+    if pillar_all:
+        pillar = "*"
+    elif roles or nodes:
+        expressions = [f"G@roles:{role}" for role in sorted(roles)]
+        if nodes:
+            expressions.append(f"L@{','.join(sorted(nodes))}")
+        pillar = " or ".join(expressions)
+
+    return {"fileserver": fileserver, "sync": "*" if sync else None, "pillar": pillar}
+
+
+def refresh_changed(conn, paths, in_repo_path):
+    """
+    Runs the `refresh_targets` for ``paths`` through the salt master on
+    ``conn``.
+    """
+
+    targets = refresh_targets(paths, in_repo_path)
+    if targets["fileserver"]:
+        conn.sudo("salt-run fileserver.update", pty=True)
+    if targets["sync"]:
+        conn.sudo(f"salt -C '{targets['sync']}' saltutil.sync_all", pty=True)
+    if targets["pillar"]:
+        conn.sudo(f"salt -C '{targets['pillar']}' saltutil.refresh_pillar", pty=True)
+    if not any(targets.values()):
+        print(f"[{conn.host}] No state or pillar changes to refresh")
+
+
 def promote_release_to_current(conn, deploy_root, release_dir):
-    with remote_tmp_dir(conn) as tmp_dir:
-        conn.run(f"ln -s {release_dir} {join(tmp_dir, 'current')}")
-        conn.run(f"mv {join(tmp_dir, 'current')} {deploy_root}")
+    """
+    Points the current link at ``release_dir`` atomically, in one remote
+    command. ``ln -sfn`` replaces a ``.new`` link left by an interrupted
+    promote instead of following it.
+    """
+
+    current_link = join(deploy_root, DEPLOY_CURRENT_LINK)
+    conn.run(
+        f"ln -sfn {release_dir} {current_link}.new && "
+        f"mv -T {current_link}.new {current_link}"
+    )
+
+
+def on_hosts(conns, *stages):
+    """
+    Runs each stage function (called with a connection) in order on every
+    connection, with all hosts running concurrently. A host stops at its first
+    failing stage without affecting the others.
+
+    Returns:
+        A dict of host to the name of the stage that failed, or None
+
+    Raises:
+        Exit: once every host has finished, if any of them failed
+    """
+
+    if not conns:
+        raise Exit("No hosts to deploy to, set SALT_MASTER")
+
+    def run(conn):
+        for stage in stages:
+            try:
+                stage(conn)
+            except Exception:
+                print(f"[{conn.host}] {stage.__name__.strip('_')} failed:")
+                traceback.print_exc()
+                return stage.__name__.strip("_")
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(conns)) as pool:
+        results = dict(zip([conn.host for conn in conns], pool.map(run, conns)))
+
+    if len(conns) > 1:
+        print("\nDeploy results:")
+        for host, failed in results.items():
+            print(f"  {host}: {'failed in ' + failed if failed else 'ok'}")
+
+    failures = [host for host, failed in results.items() if failed]
+    if failures:
+        raise Exit(f"Deploy failed on {', '.join(failures)}")
+    return results
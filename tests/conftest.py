@@ -0,0 +1,33 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+STATES_ROOT = Path(__file__).resolve().parent.parent / "root" / "states"
+
+
+@pytest.fixture
+def load_module():
+    """
+    Loads a salt extension module the way the loader does: as a new module
+    object on every call, with the given loader dunders set.
+    """
+
+    state_modules = set(sys.modules)
+
+    def load(path, **dunders):
+        name = Path(path).stem
+        spec = importlib.util.spec_from_file_location(name, STATES_ROOT / path)
+        module = importlib.util.module_from_spec(spec)
+        for key, value in dunders.items():
+            setattr(module, key, value)
+        spec.loader.exec_module(module)
+        return module
+
+    yield load
+
+    # Drop the process-wide holders the modules registered
+    for name in set(sys.modules) - state_modules:
+        if name.startswith("salt_ext_"):
+            del sys.modules[name]
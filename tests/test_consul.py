@@ -0,0 +1,31 @@
+import atexit
+import os
+
+import pytest
+
+pytest.importorskip("salt")
+
+
+def config_get(key, default=None):
+    return {"consul:host": "http://consul.test:8500"}.get(key, default)
+
+
+def test_pool_is_shared_between_loader_instances(load_module, monkeypatch):
+    registered = []
+    monkeypatch.setattr(os, "register_at_fork", lambda **kw: registered.append(kw))
+    monkeypatch.setattr(atexit, "register", lambda *a: registered.append(a))
+
+    sessions = []
+    for _ in range(2):
+        module = load_module(
+            "_modules/consul.py",
+            __salt__={"config.get": config_get},
+            __context__={},
+        )
+        sessions.append(module.get_session(None, None))
+
+    assert sessions[0] is sessions[1]
+    # One fork hook and one exit hook, whatever else the imports registered
+    hooks = [hook for hook in registered if "salt_ext_consul_pool" in repr(hook)]
+    assert len(hooks) == 2
+    sessions[0].close()
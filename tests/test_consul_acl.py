@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("salt")
+
+
+def chunk(name, **kwargs):
+    return dict(state="consul_policy", __id__=name, name=name, fun="manage", **kwargs)
+
+
+def desired(chunk):
+    return {"name": chunk["name"]}
+
+
+def test_chunks_with_requisites_are_not_aggregated(load_module):
+    module = load_module("_utils/consul_acl.py")
+    low = chunk("a")
+    chunks = [low, chunk("b"), chunk("c", require=[{"consul_policy": "a"}])]
+
+    low = module.aggregate_chunks(low, chunks, {}, desired)
+
+    assert low["aggregated"] == [{"name": "a"}, {"name": "b"}]
+    assert "__agg__" in chunks[1] and "__agg__" not in chunks[2]
+
+
+def test_manage_reconciles_once_for_every_aggregated_chunk(load_module):
+    module = load_module("_utils/consul_acl.py")
+    calls = []
+
+    def reconcile(desired, consul_host, consul_token, test=False):
+        calls.append(desired)
+        return {policy["name"]: {"name": policy["name"]} for policy in desired}
+
+    functions = {
+        "config.get": lambda key, default=None: default,
+        "consul.reconcile_policies": reconcile,
+    }
+    context = {}
+    policies = [{"name": "a"}, {"name": "b"}]
+    for name in ("a", "b"):
+        key = (None, None, name)
+        ret = module.manage(functions, context, "policies", key, policies, False)
+        assert ret == {"name": name}
+
+    assert calls == [policies]
+    assert context == {"consul_acl.policies_results": {}}
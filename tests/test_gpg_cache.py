@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("salt")
+
+CIPHERTEXT = "-----BEGIN PGP MESSAGE-----\nabc\n-----END PGP MESSAGE-----"
+
+
+def test_cache_is_shared_between_loader_instances(load_module):
+    decrypted = []
+
+    def decrypt(ciphertexts):
+        decrypted.extend(ciphertexts)
+        return {ciphertext: "s3cret" for ciphertext in ciphertexts}
+
+    pillar = {"consul": {"token": CIPHERTEXT}}
+    for _ in range(2):
+        module = load_module("_pillar/gpg_cache.py", __opts__={})
+        module._decrypt = decrypt
+        assert module.ext_pillar("minion", pillar) == {"consul": {"token": "s3cret"}}
+
+    assert decrypted == [CIPHERTEXT]
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+pytest.importorskip("salt")
+pytest.importorskip("jinja2")
+
+
+def load(load_module, tmp_path):
+    return load_module(
+        "_pillar/stack_cache.py",
+        __opts__={"cachedir": str(tmp_path / "cache")},
+        __grains__={"roles": ["web"]},
+        __salt__={},
+    )
+
+
+def test_edited_layers_are_rendered_without_revision(load_module, tmp_path):
+    root = tmp_path / "pillar"
+    (root / "common").mkdir(parents=True)
+    common = root / "common" / "consul.yml"
+    common.write_text("consul:\n  version: 1.4.3\n")
+
+    module = load(load_module, tmp_path)
+    pillar = module.ext_pillar("minion", {}, str(root))
+    assert pillar["consul"] == {"version": "1.4.3"}
+    assert pillar["salt"] == {"revision": None}
+
+    common.write_text("consul:\n  version: 1.4.4\n")
+    stat = common.stat()
+    os.utime(common, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    module = load(load_module, tmp_path)
+    assert module.ext_pillar("minion", {}, str(root))["consul"] == {"version": "1.4.4"}
+
+
+def test_memory_cache_is_shared_between_loader_instances(load_module, tmp_path):
+    root = tmp_path / "release" / "pillar"
+    (root / "common").mkdir(parents=True)
+    (root / "common" / "consul.yml").write_text("consul:\n  version: 1.4.3\n")
+    (tmp_path / "release" / "REVISION").write_text("abc123\n")
+
+    rendered = []
+    for _ in range(2):
+        module = load(load_module, tmp_path)
+        render_layers = module._render_layers
+
+        def counting(root, patterns, *args, render_layers=render_layers):
+            rendered.append(patterns)
+            return render_layers(root, patterns, *args)
+
+        module._render_layers = counting
+        module._read_disk = lambda key: None
+        pillar = module.ext_pillar("minion", {}, str(root))
+        assert pillar["consul"] == {"version": "1.4.3"}
+        assert pillar["salt"] == {"revision": "abc123"}
+
+    shared = [patterns for patterns in rendered if "common/*.yml" in patterns]
+    assert len(shared) == 1
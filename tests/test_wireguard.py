@@ -0,0 +1,66 @@
+import pytest
+
+pytest.importorskip("salt")
+
+PUBLIC_KEY = "peerkey="
+ALLOWED_IPS = "192.168.16.2/32"
+
+
+def _dump(endpoint):
+    return "\n".join(
+        [
+            "privkey=\tpubkey=\t51820\toff",
+            f"{PUBLIC_KEY}\t(none)\t{endpoint}\t{ALLOWED_IPS}\t0\t0\t0\toff",
+        ]
+    )
+
+
+@pytest.fixture
+def wireguard(load_module, tmp_path):
+    calls = []
+    live = {"endpoint": "203.0.113.1:51820"}
+
+    def run_all(cmd, stdin=None, **kwargs):
+        calls.append(cmd)
+        if cmd[1] == "show":
+            return {"retcode": 0, "stdout": _dump(live["endpoint"]), "stderr": ""}
+        return {"retcode": 0, "stdout": "", "stderr": ""}
+
+    module = load_module(
+        "_modules/wireguard.py",
+        __opts__={"cachedir": str(tmp_path)},
+        __salt__={"cmd.run_all": run_all},
+    )
+    module.calls = calls
+    module.live = live
+    return module
+
+
+def _peer(endpoint):
+    return {"public_key": PUBLIC_KEY, "endpoint": endpoint, "allowed_ips": ALLOWED_IPS}
+
+
+def _sets(calls):
+    return [cmd for cmd in calls if cmd[1] == "set"]
+
+
+def test_changed_endpoint_is_set(wireguard):
+    assert wireguard.sync_peers("wg0", [_peer("203.0.113.1:51820")]) == {}
+
+    changes = wireguard.sync_peers("wg0", [_peer("203.0.113.2:51820")])
+
+    assert changes == {
+        PUBLIC_KEY: {
+            "endpoint": {"old": "203.0.113.1:51820", "new": "203.0.113.2:51820"}
+        }
+    }
+    (cmd,) = _sets(wireguard.calls)
+    assert cmd[cmd.index("endpoint") + 1] == "203.0.113.2:51820"
+
+
+def test_roamed_peer_is_left_alone(wireguard):
+    wireguard.sync_peers("wg0", [_peer("203.0.113.1:51820")])
+    wireguard.live["endpoint"] = "198.51.100.7:40000"
+
+    assert wireguard.sync_peers("wg0", [_peer("203.0.113.1:51820")]) == {}
+    assert _sets(wireguard.calls) == []